@@ -0,0 +1,260 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import time
+from typing import AsyncGenerator, Callable, Dict, Hashable, List, Optional, Tuple
+
+from backend.metrics import CACHE_LOOKUPS
+from backend.snapshot import SnapshotStore, multi_worker, snapshot_store
+
+
+# how many seconds partition results are served from memory and how many partitions are kept
+_TTL = float(os.environ.get("SWAMP_CACHE_TTL", "60"))
+_MAX_ENTRIES = int(os.environ.get("SWAMP_CACHE_MAX_ENTRIES", "1024"))
+# with several workers - for how long one of them can fetch a partition before others stop waiting for it,
+# and how often they check whether it is done
+_LEASE = float(os.environ.get("SWAMP_CACHE_LEASE", "60"))
+_LEASE_POLL_INTERVAL = 0.2
+
+_force_refresh = ContextVar("force_refresh", default=False)
+_max_stale: ContextVar[Optional[float]] = ContextVar("max_stale", default=None)
+_shared_flights: ContextVar[Optional[Dict[Hashable, "_Flight"]]] = ContextVar("shared_flights", default=None)
+
+
+@contextmanager
+def cache_control(header: Optional[str]):
+    # honoring "Cache-Control: no-cache" (and friends) sent with the request - results are fetched from upstream again
+    # "Cache-Control: max-stale[=seconds]" accepts the last persisted snapshot while it is being refreshed in background
+    directives = {d.strip().lower() for d in (header or "").split(",")}
+    token = _force_refresh.set(bool(directives & {"no-cache", "no-store", "max-age=0"}))
+    stale_token = _max_stale.set(_parse_max_stale(directives))
+    try:
+        yield
+    finally:
+        _max_stale.reset(stale_token)
+        _force_refresh.reset(token)
+
+
+def _parse_max_stale(directives) -> Optional[float]:
+    for d in directives:
+        name, _, value = d.partition("=")
+        if name.strip() == "max-stale":
+            try:
+                return float(value) if value else float("inf")
+            except ValueError:
+                return None
+    return None
+
+
+def max_stale() -> Optional[float]:
+    return _max_stale.get()
+
+
+@contextmanager
+def shared_results():
+    # every partition is fetched at most once within this block (e.g. a batch of queries), regardless of cache TTL
+    token = _shared_flights.set({})
+    try:
+        yield
+    finally:
+        _shared_flights.reset(token)
+
+
+class _Flight:
+    # single upstream fetch that any number of readers can follow while it is still running
+    def __init__(self):
+        self.items: List[Dict] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._changed = asyncio.Event()
+
+    async def run(self, factory: Callable[[], AsyncGenerator[Dict, None]]):
+        try:
+            async for item in factory():
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        except asyncio.CancelledError:
+            self.error = RuntimeError("Upstream fetch was cancelled")
+            raise
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def iter(self) -> AsyncGenerator[Dict, None]:
+        i = 0
+        while True:
+            while i < len(self.items):
+                yield self.items[i]
+                i += 1
+            if self.done:
+                if self.error:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class ResultCache:
+    def __init__(self, ttl: float, max_entries: int, store: Optional[SnapshotStore] = None, shared: bool = False):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._snapshots = store
+        # store is shared with other processes, which coordinate fetches through it
+        self._shared = shared and store is not None
+        self._entries: OrderedDict[Hashable, Tuple[float, List[Dict]]] = OrderedDict()
+        self._flights: Dict[Hashable, Tuple[_Flight, asyncio.Task]] = {}
+
+    async def get(self, key: Hashable, factory: Callable[[], AsyncGenerator[Dict, None]]) -> AsyncGenerator[Dict, None]:
+        shared = _shared_flights.get()
+        if shared is not None and key in shared:
+            CACHE_LOOKUPS.inc(result="shared")
+            async for item in shared[key].iter():
+                yield item
+            return
+        if not _force_refresh.get():
+            items = self._lookup(key)
+            if items is not None:
+                CACHE_LOOKUPS.inc(result="hit")
+                for item in items:
+                    yield item
+                return
+            snapshot = await self._load_snapshot(key)
+            if snapshot is not None:
+                age, items = snapshot
+                if age <= self._ttl:
+                    # e.g. fetched by another worker, or before a restart
+                    CACHE_LOOKUPS.inc(result="store")
+                    self._store(key, items, age)
+                else:
+                    CACHE_LOOKUPS.inc(result="stale")
+                    self._flight(key, factory)
+                for item in items:
+                    yield item
+                return
+        CACHE_LOOKUPS.inc(result="joined" if key in self._flights else "miss")
+        flight = self._flight(key, factory)
+        if shared is not None:
+            shared[key] = flight
+        async for item in flight.iter():
+            yield item
+
+    def _flight(self, key: Hashable, factory: Callable[[], AsyncGenerator[Dict, None]]) -> _Flight:
+        if key not in self._flights:
+            flight = _Flight()
+            self._flights[key] = flight, asyncio.create_task(self._fly(key, flight, factory))
+        return self._flights[key][0]
+
+    async def _fly(self, key: Hashable, flight: _Flight, factory: Callable[[], AsyncGenerator[Dict, None]]):
+        # running in its own task, so the fetch completes (and gets cached) even if the reader that started it goes away
+        try:
+            await flight.run(lambda: self._fetch(key, factory) if self._shared else factory())
+            if not flight.error:
+                self._store(key, flight.items)
+        finally:
+            del self._flights[key]
+        if not flight.error and self._snapshots is not None and not self._shared:
+            await self._persist(self._snapshots.save(key, flight.items))
+
+    async def _fetch(self, key: Hashable, factory: Callable[[], AsyncGenerator[Dict, None]]) -> AsyncGenerator[Dict, None]:
+        # only one of the workers fetches a partition at a time, others wait for its result to appear in the store
+        claimed = False
+        try:
+            peer_items = await self._wait_for_peer(key)
+            claimed = peer_items is None
+        except Exception as e:
+            logging.exception(e)  # store is not usable right now, fetching on our own
+            peer_items = None
+        if peer_items is not None:
+            CACHE_LOOKUPS.inc(result="peer")
+            for item in peer_items:
+                yield item
+            return
+        try:
+            items = []
+            async for item in factory():
+                items.append(item)
+                yield item
+            # saved before the lease is released, so that waiting workers find it
+            await self._persist(self._snapshots.save(key, items))
+        finally:
+            if claimed:
+                await self._persist(self._snapshots.release(key))
+
+    @staticmethod
+    async def _persist(write):
+        # results were fetched fine, failing to persist them should not fail the query
+        try:
+            await write
+        except Exception as e:
+            logging.exception(e)
+
+    async def _wait_for_peer(self, key: Hashable) -> Optional[List[Dict]]:
+        # items fetched by another worker since we started waiting, or None once we hold the lease
+        started = time.time()
+        while True:
+            claimed = await self._snapshots.claim(key, _LEASE)
+            # checked after claiming - a peer saves its items before it releases the lease, so they are not missed;
+            # only timestamps are polled, items are read once they are new
+            fetched_at = await self._snapshots.fetched_at(key)
+            if fetched_at is not None and fetched_at >= started:
+                if claimed:
+                    await self._snapshots.release(key)
+                snapshot = await self._snapshots.load(key)
+                if snapshot is not None:
+                    return snapshot[1]
+            elif claimed:
+                return None
+            await asyncio.sleep(_LEASE_POLL_INTERVAL)
+
+    async def _load_snapshot(self, key: Hashable) -> Optional[Tuple[float, List[Dict]]]:
+        # age and items of persisted snapshot, if it is recent enough to be served
+        if self._snapshots is None:
+            return None
+        stale = _max_stale.get() or 0
+        try:
+            snapshot = await self._snapshots.load(key)
+        except Exception as e:
+            logging.exception(e)
+            return None
+        if snapshot is None:
+            return None
+        fetched_at, items = snapshot
+        age = time.time() - fetched_at
+        return (age, items) if age <= self._ttl + stale else None
+
+    def _lookup(self, key: Hashable) -> Optional[List[Dict]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, items = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return items
+
+    def _store(self, key: Hashable, items: List[Dict], age: float = 0):
+        if self._ttl <= 0:
+            return
+        self._entries[key] = time.monotonic() + self._ttl - age, items
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_RESULT_CACHE = ResultCache(_TTL, _MAX_ENTRIES, snapshot_store(), multi_worker())
+
+
+def cached(key: Hashable, factory: Callable[[], AsyncGenerator[Dict, None]]) -> AsyncGenerator[Dict, None]:
+    return _RESULT_CACHE.get(key, factory)
@@ -0,0 +1,74 @@
+from collections import defaultdict
+from functools import lru_cache
+import json
+from typing import Dict, Iterable, List, Tuple
+
+import jq
+
+from backend.model import GenericQueryException, Link
+
+
+@lru_cache(maxsize=256)
+def _compile_extractor(attr: str):
+    # one jq invocation extracts join keys of all items; an item the expression fails on simply has no keys
+    attr = attr if attr.startswith(".") else f".{attr}"
+    return jq.compile(f"[.[] | [try ({attr})]]")
+
+
+def _as_text(value) -> str:
+    # same text jq -r -c prints, which is what links were compared on in the UI
+    return value if isinstance(value, str) else json.dumps(value, separators=(",", ":"))
+
+
+def extract_keys(items: List[Dict], attr: str) -> List[Tuple[str, ...]]:
+    try:
+        outputs = _compile_extractor(attr).input_value(items).first()
+    except ValueError as e:
+        raise GenericQueryException(f"Invalid attribute {attr}: {e}")
+    return [tuple(_as_text(v) for v in values if v is not None) for values in outputs]
+
+
+def join(left: List[Dict], right: List[Dict], link: Link) -> List[Tuple[int, int]]:
+    # returns (left index, right index) pairs of items that are linked
+    left_keys, right_keys = extract_keys(left, link.from_attr), extract_keys(right, link.to_attr)
+    if link.op in {"=", "=="}:
+        return _hash_join(left_keys, right_keys, lambda keys: [keys] if keys else [])
+    if link.op == "!=":
+        return _anti_join(left_keys, right_keys, _hash_join(left_keys, right_keys, lambda keys: [keys] if keys else []))
+    if link.op == "contains":
+        return _hash_join(left_keys, right_keys, lambda keys: set(keys))
+    if link.op == "not contains":
+        return _anti_join(left_keys, right_keys, _hash_join(left_keys, right_keys, lambda keys: set(keys)))
+    if link.op in {"like", "not like"}:
+        # substring match cannot be indexed, falling back to comparing every pair
+        expected = link.op == "like"
+        return [
+            (i, j)
+            for i, lk in enumerate(left_keys) if lk
+            for j, rk in enumerate(right_keys) if rk and ("\n".join(rk) in "\n".join(lk)) == expected
+        ]
+    raise GenericQueryException(f"Unsupported link operator {link.op}")
+
+
+def _hash_join(left_keys, right_keys, index_keys) -> List[Tuple[int, int]]:
+    # building the index on the smaller side and probing it with the bigger one
+    swap = len(right_keys) < len(left_keys)
+    build, probe = (right_keys, left_keys) if swap else (left_keys, right_keys)
+    index = defaultdict(list)
+    for i, keys in enumerate(build):
+        for key in index_keys(keys):
+            index[key].append(i)
+    pairs = set()
+    for j, keys in enumerate(probe):
+        for key in index_keys(keys):
+            pairs.update((i, j) for i in index.get(key, ()))
+    return sorted((j, i) if swap else (i, j) for i, j in pairs)
+
+
+def _anti_join(left_keys, right_keys, matched: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    matched = set(matched)
+    return [
+        (i, j)
+        for i, lk in enumerate(left_keys) if lk
+        for j, rk in enumerate(right_keys) if rk and (i, j) not in matched
+    ]
@@ -1,15 +1,79 @@
+import asyncio
 import base64
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.exceptions import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from functools import lru_cache
+import hashlib
+import orjson
+import os
+import time
 import uvicorn
-from typing import Iterable, Tuple
+from pydantic import BaseModel, ConfigDict, Field
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Tuple
 import logging
 
-from backend.model import Label, GenericQueryException, iter_all_resource_types, provider
+from backend.cache import cache_control, shared_results
+from backend.join import join
+from backend.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, SERIALIZATION, MetricsMiddleware, publish as publish_metrics,
+    render as render_metrics, render_workers as render_worker_metrics
+)
+from backend.model import (
+    Label, Link, GenericQueryException, GraphLink, close_providers, filter_records, iter_all_resource_types, provider
+)
+from backend.planner import execute
+from backend.snapshot import multi_worker, snapshot_store
+from backend.tracing import Trace, span, trace_requested, tracing
+from backend.utils import iter_concurrently, partition_events
+
+
+def dump_json(value) -> bytes:
+    # datetimes (and anything else JSON does not know) end up as str(value), same as json.dumps(default=str) did
+    return orjson.dumps(value, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+class FastJSONResponse(JSONResponse):
+    # results are plain JSON already, so we skip jsonable_encoder (by returning a response) and encode with orjson
+    def render(self, content) -> bytes:
+        with SERIALIZATION.time(format="json"), span("encode", format="json"):
+            return dump_json(content)
+
+
+# for how many seconds browsers can reuse metadata (resource types, examples) before checking its ETag again
+_METADATA_MAX_AGE = int(os.environ.get("SWAMP_METADATA_MAX_AGE", "300"))
+
+
+def metadata_response(r: Request, body: bytes) -> Response:
+    # metadata only changes with provider code or its dependencies (e.g. botocore version), so its hash is a good ETag
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": f"max-age={_METADATA_MAX_AGE}"}
+    if etag in {t.strip().removeprefix("W/") for t in r.headers.get("if-none-match", "").split(",")}:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
 
+@lru_cache(maxsize=None)
+def resource_types_body() -> bytes:
+    return dump_json([t.model_dump() for t in iter_all_resource_types()])
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # resource types are needed as soon as UI starts, so they are prepared in background right away
+    prewarm = asyncio.create_task(asyncio.to_thread(resource_types_body))
+    publisher = asyncio.create_task(publish_metrics(snapshot_store())) if multi_worker() else None
+    yield
+    if publisher is not None:
+        publisher.cancel()
+        await asyncio.gather(publisher, return_exceptions=True)
+    await asyncio.gather(prewarm, return_exceptions=True)
+    await close_providers()
+
+
+app = FastAPI(lifespan=lifespan)
 # fixme
 app.add_middleware(
     CORSMiddleware,
@@ -18,14 +82,18 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
-# todo: cache?
+@app.get("/metrics")
+async def metrics():
+    body = await render_worker_metrics(snapshot_store()) if multi_worker() else render_metrics()
+    return Response(body, media_type=METRICS_CONTENT_TYPE)
 
 
 @app.get("/resource-types")
-async def resource_types():
-    return list(iter_all_resource_types())
+async def resource_types(r: Request):
+    return metadata_response(r, await asyncio.to_thread(resource_types_body))
 
 
 @app.get("/attributes")
@@ -55,23 +123,152 @@ async def example(r: Request):
     p, resource = extract_provider_and_resource(r)
     try:
         result = await provider(p).example(resource)
-        return result
+        return metadata_response(r, dump_json(result))
     except GenericQueryException as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/get")
 async def get(r: Request):
+    # "X-Swamp-Trace: 1" returns timeline of the request - in Server-Timing header, or as the last event of a stream
+    try:
+        with tracing(trace_requested(r.headers.get("x-swamp-trace"))) as trace:
+            with span("labels"):
+                p, resource = extract_provider_and_resource(r)
+                labels = {k: v for k, v in iter_request_labels(r)}
+            if "_stream" in r.query_params:
+                return await stream_get(p, resource, labels, r.query_params["_stream"], r.headers.get("cache-control"), trace)
+            with cache_control(r.headers.get("cache-control")):
+                results, errors = await do_partial_get(p, resource, labels)
+            response = FastJSONResponse({"results": results, "errors": errors})
+        if trace is not None:
+            response.headers["Server-Timing"] = trace.server_timing()
+            response.headers["Timing-Allow-Origin"] = "*"
+        return response
+    except GenericQueryException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.exception(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/watch")
+async def watch(r: Request):
+    # change feed - current results first (as "added" events), then changes to them as they happen
     try:
         p, resource = extract_provider_and_resource(r)
         labels = {k: v for k, v in iter_request_labels(r)}
-        results = await do_get(p, resource, labels)
-        return {"results": results}
+        return await stream_events(iter_watch_events(p, resource, labels), r.query_params.get("_stream", "ndjson"))
+    except GenericQueryException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+class VertexQuery(BaseModel):
+    id: str
+    provider: str
+    resource: str
+    labels: List[Label] = []
+
+
+class BatchQuery(BaseModel):
+    queries: List[VertexQuery]
+
+
+@app.post("/batch-get")
+async def batch_get(r: Request, batch: BatchQuery):
+    stream_format = r.query_params.get("_stream", "ndjson")
+    if stream_format not in _STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f'"_stream" must be one of: {", ".join(_STREAM_FORMATS)}')
+    media_type, encode = _STREAM_FORMATS[stream_format]
+    events = iter_batch_events(batch.queries, r.headers.get("cache-control"))
+    return StreamingResponse((encode(e) async for e in events), media_type=media_type)
+
+
+class JoinSide(BaseModel):
+    results: Optional[List[Dict]] = None
+    query: Optional[VertexQuery] = None
+
+
+class JoinRequest(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    link: Link
+    from_: JoinSide = Field(alias="from")
+    to: JoinSide
+
+
+@app.post("/join")
+async def join_results(r: Request, request: JoinRequest):
+    try:
+        with cache_control(r.headers.get("cache-control")), shared_results():
+            left, right = await asyncio.gather(join_side(request.from_), join_side(request.to))
+        edges = await asyncio.to_thread(join, left, right, request.link)
     except GenericQueryException as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         logging.exception(e)
         raise HTTPException(status_code=500, detail=str(e))
+    response = {"edges": [{"from": i, "to": j} for i, j in edges]}
+    # results of queried sides are returned too, edges are indices to them
+    if request.from_.query:
+        response["from"] = left
+    if request.to.query:
+        response["to"] = right
+    return FastJSONResponse(response)
+
+
+class GraphQuery(BaseModel):
+    vertices: List[VertexQuery]
+    links: List[GraphLink] = []
+
+
+@app.post("/graph")
+async def graph(r: Request, graph_query: GraphQuery):
+    # the whole query graph at once - keys found by a link's source narrow down the query of its target,
+    # so multi-hop queries fetch only what is reachable
+    vertices = {q.id: q for q in graph_query.vertices}
+    errors = {}
+
+    async def query(vertex_id: str, extra: List[Label]) -> List[Dict]:
+        q = vertices[vertex_id]
+        labels = {l.key: l for l in q.labels}
+        for l in extra:
+            # vertex's own label on the same key stays where providers look for it
+            labels[l.key if l.key not in labels else f"{l.key} ({l.op.value})"] = l
+        try:
+            results, errors[vertex_id] = await do_partial_get(q.provider, q.resource, labels)
+        except GenericQueryException:
+            raise
+        except Exception as e:
+            logging.exception(e)
+            results, errors[vertex_id] = [], [{"detail": str(e)}]
+        return results
+
+    try:
+        with cache_control(r.headers.get("cache-control")), shared_results():
+            results = await execute([q.id for q in graph_query.vertices], graph_query.links, query)
+        edges = await asyncio.gather(*(
+            asyncio.to_thread(join, results[l.from_vertex], results[l.to_vertex], l) for l in graph_query.links
+        ))
+    except GenericQueryException as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({
+        "results": results,
+        "edges": [{"link": k, "from": i, "to": j} for k, pairs in enumerate(edges) for i, j in pairs],
+        "errors": {v: e for v, e in errors.items() if e},
+    })
+
+
+async def join_side(side: JoinSide) -> List[Dict]:
+    if side.results is not None:
+        return side.results
+    if side.query is not None:
+        return await do_get(side.query.provider, side.query.resource, {l.key: l for l in side.query.labels})
+    raise GenericQueryException("Each side of a join needs either results or query")
 
 
 def extract_provider_and_resource(request: Request):
@@ -101,8 +298,139 @@ def iter_request_labels(request: Request) -> Iterable[Tuple[str, Label]]:
 async def do_get(p, resource, labels):
     # some of the filters might not get used, running this for the second time on actual results
     results = [r async for r in provider(p).get(resource, labels)]
-    return [r for r in results if all(l.matches(r) for l in labels.values())]
+    with span("filter", records=str(len(results)), labels=str(len(labels))):
+        return filter_records(results, labels.values())
+
+
+async def do_partial_get(p, resource, labels) -> Tuple[List[Dict], List[Dict]]:
+    # same as do_get, but a failed partition (e.g. region that keeps throttling us) only adds an error next to
+    # results of the other ones - unless there are no other ones
+    events = []
+    with partition_events(events.append):
+        results = await do_get(p, resource, labels)
+    errors = [{"partition": e["partition"], "detail": e["detail"]} for e in events if e["status"] == "error"]
+    if errors and not any(e["status"] == "done" for e in events):
+        raise RuntimeError(errors[0]["detail"])
+    return results, errors
+
+
+_STREAM_FORMATS = {
+    "ndjson": ("application/x-ndjson", lambda e: dump_json(e) + b"\n"),
+    "sse": ("text/event-stream", lambda e: b"event: " + e["type"].encode() + b"\ndata: " + dump_json(e) + b"\n\n"),
+}
+
+
+async def stream_get(p, resource, labels, stream_format: str, cache_control_header: Optional[str], trace: Optional[Trace] = None):
+    return await stream_events(iter_get_events(p, resource, labels, cache_control_header), stream_format, trace)
+
+
+async def stream_events(events: AsyncGenerator[Dict, None], stream_format: str, trace: Optional[Trace] = None):
+    if stream_format not in _STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f'"_stream" must be one of: {", ".join(_STREAM_FORMATS)}')
+    media_type, encode = _STREAM_FORMATS[stream_format]
+    # waiting for the first event here, so that invalid queries still end up as regular HTTP errors
+    # (there might be none, e.g. no partition matched the labels)
+    first = await anext(events, None)
+
+    async def body():
+        # encoding time of the whole stream is observed once, at its end
+        encoding = 0.0
+
+        def timed_encode(event):
+            nonlocal encoding
+            start = time.perf_counter()
+            chunk = encode(event)
+            encoding += time.perf_counter() - start
+            return chunk
+
+        try:
+            if first is not None:
+                yield timed_encode(first)
+            async for event in events:
+                yield timed_encode(event)
+        except Exception as e:
+            logging.exception(e)
+            yield encode({"type": "error", "detail": str(e)})
+        finally:
+            SERIALIZATION.observe(encoding, format=stream_format)
+        if trace is not None:
+            yield encode({"type": "trace", "encode_ms": round(encoding * 1000, 3), "spans": trace.to_dicts()})
+
+    return StreamingResponse(body(), media_type=media_type)
+
+
+_END = object()
+
+
+async def iter_get_events(p, resource, labels, cache_control_header: Optional[str] = None) -> AsyncGenerator[Dict, None]:
+    # same as do_get, but yields every result as soon as it passes filters, along with progress of every partition
+    queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            with cache_control(cache_control_header), partition_events(lambda e: queue.put_nowait({"type": "partition", **e})):
+                async for r in provider(p).get(resource, labels):
+                    if all(l.matches(r) for l in labels.values()):
+                        queue.put_nowait({"type": "result", "result": r})
+            queue.put_nowait(_END)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        count = 0
+        while True:
+            event = await queue.get()
+            if event is _END:
+                break
+            if isinstance(event, Exception):
+                raise event
+            count += event["type"] == "result"
+            yield event
+        yield {"type": "done", "count": count}
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+
+async def iter_watch_events(p, resource, labels) -> AsyncGenerator[Dict, None]:
+    async for event in provider(p).watch(resource, labels):
+        if "result" in event and not all(l.matches(event["result"]) for l in labels.values()):
+            if event["type"] != "modified":
+                continue
+            # it might have matched before the change
+            event = {"type": "deleted", "result": event["result"]}
+        yield event
+
+
+async def iter_batch_events(queries: List[VertexQuery], cache_control_header: Optional[str] = None) -> AsyncGenerator[Dict, None]:
+    # runs all vertex queries at once, every event is tagged with id of the vertex it belongs to;
+    # partitions shared by several vertices (same provider, resource, profile/region...) are fetched only once
+    async def vertex_events(q: VertexQuery):
+        try:
+            async for event in iter_get_events(q.provider, q.resource, {l.key: l for l in q.labels}, cache_control_header):
+                yield {"vertex": q.id, **event}
+        except Exception as e:
+            if not isinstance(e, GenericQueryException):
+                logging.exception(e)
+            yield {"vertex": q.id, "type": "error", "detail": str(e)}
+
+    async def all_events():
+        with shared_results():
+            jobs = [({"vertex": q.id}, lambda q=q: vertex_events(q)) for q in queries]
+            async for event in iter_concurrently(jobs, max(len(jobs), 1)):
+                yield event
+
+    # running in a separate task, so that shared results are scoped to it and not to the consumer of this generator
+    async for event in iter_concurrently([({}, all_events)], 1):
+        yield event
 
 
 def start():
-    uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, reload=True)
+    # SWAMP_WORKERS > 1 runs that many server processes, sharing results through SQLite store (see backend.snapshot);
+    # reloading on code changes only works with a single one
+    workers = int(os.environ.get("SWAMP_WORKERS", "1"))
+    if workers > 1:
+        uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, reload=True)
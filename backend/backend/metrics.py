@@ -0,0 +1,250 @@
+import asyncio
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+import logging
+import math
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from backend.snapshot import SnapshotStore
+from backend.tracing import span
+
+
+# prometheus text exposition format (version 0.0.4) - small enough to not need a client library for it
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+# with several workers - how often each of them publishes its metrics to the shared store
+_PUBLISH_INTERVAL = float(os.environ.get("SWAMP_METRICS_PUBLISH_INTERVAL", "5"))
+
+_METRICS: List["_Metric"] = []
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        _METRICS.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[l]) for l in self.labels)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{l}="{_escape(v)}"' for l, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self, values: Dict) -> List[str]:
+        return []
+
+    def state(self) -> List:
+        # JSON friendly copy of values, so that they can be merged with values of other processes
+        return [[list(k), v] for k, v in list(self._values.items())]
+
+    def _merge(self, states: List[List]) -> Dict:
+        return {}
+
+    def render(self, states: Optional[List[List]] = None) -> str:
+        values = self._values if states is None else self._merge(states)
+        return "\n".join([
+            f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}", *self.samples(values)
+        ])
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels: str):
+        self._values[self._key(labels)] += amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _merge(self, states: List[List]) -> Dict:
+        values = defaultdict(float)
+        for state in states:
+            for key, value in state:
+                values[tuple(key)] += value
+        return values
+
+    def samples(self, values: Dict) -> List[str]:
+        return [f"{self.name}{self._format_labels(k)} {_number(v)}" for k, v in list(values.items())]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str):
+        self._values[self._key(labels)] -= amount
+
+    @contextmanager
+    def track(self, **labels: str):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = _DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # per label values: count in every bucket (not cumulative, last one is +Inf), sum
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def _merge(self, states: List[List]) -> Dict:
+        values = {}
+        for state in states:
+            for key, (counts, total) in state:
+                entry = values.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+        return values
+
+    def samples(self, values: Dict) -> List[str]:
+        lines = []
+        for key, (counts, total) in list(values.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, math.inf], counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _number(bound)
+                bucket = self._format_labels(key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def state() -> Dict[str, List]:
+    return {m.name: m.state() for m in _METRICS}
+
+
+def render(states: Optional[List[Dict[str, List]]] = None) -> bytes:
+    # states are of several processes, which get summed up - otherwise only this process is rendered
+    rendered = (m.render(None if states is None else [s.get(m.name, []) for s in states]) for m in _METRICS)
+    return ("\n".join(rendered) + "\n").encode()
+
+
+async def publish(store: SnapshotStore):
+    # with several workers every one of them keeps its metrics in the shared store, so that /metrics (served by
+    # any of them) covers all of them
+    while True:
+        try:
+            await store.save_metadata(f"metrics:{os.getpid()}", state())
+        except Exception as e:
+            logging.exception(e)
+        await asyncio.sleep(_PUBLISH_INTERVAL)
+
+
+async def render_workers(store: SnapshotStore) -> bytes:
+    # workers that did not publish for a while are gone, so are their metrics
+    published = await store.load_metadata_with_prefix("metrics:", 3 * _PUBLISH_INTERVAL)
+    own = f"metrics:{os.getpid()}"
+    return render([state(), *(value for name, (_, value) in published.items() if name != own)])
+
+
+HTTP_REQUESTS = Histogram(
+    "swamp_http_request_seconds", "Time to handle HTTP request (until response starts streaming)", ["method", "path", "status"]
+)
+HTTP_IN_FLIGHT = Gauge("swamp_http_requests_in_flight", "HTTP requests being handled (including streaming responses)")
+
+# service is AWS client (e.g. ec2) or K8S kind, location is AWS region or K8S context
+UPSTREAM_REQUESTS = Histogram(
+    "swamp_upstream_request_seconds", "Latency of calls to cloud APIs (a single page for paginated ones)",
+    ["provider", "service", "location"]
+)
+UPSTREAM_ERRORS = Counter("swamp_upstream_errors_total", "Failed calls to cloud APIs", ["provider", "service", "location"])
+UPSTREAM_ITEMS = Counter("swamp_upstream_items_total", "Items returned by cloud APIs", ["provider", "service", "location"])
+UPSTREAM_IN_FLIGHT = Gauge("swamp_upstream_requests_in_flight", "Calls to cloud APIs waiting for response", ["provider"])
+
+# hit - result cache, store - fresh persisted snapshot, stale - expired persisted snapshot (refreshed in background),
+# shared - fetched for another vertex of the same batch, joined - fetch of the same partition was already running,
+# peer - fetched by another worker, miss - fetched from upstream
+CACHE_LOOKUPS = Counter("swamp_cache_lookups_total", "Result cache lookups of a single partition", ["result"])
+
+FILTER = Histogram(
+    "swamp_filter_seconds", "Time to evaluate a label on a batch of records", ["op"], buckets=_FAST_BUCKETS
+)
+FILTERED_RECORDS = Counter("swamp_filter_records_total", "Records a label was evaluated on", ["op"])
+SERIALIZATION = Histogram(
+    "swamp_serialization_seconds", "Time spent encoding a response", ["format"], buckets=_FAST_BUCKETS
+)
+
+
+@contextmanager
+def upstream_call(provider: str, service: str, location: str):
+    # wraps a single call to cloud API
+    with UPSTREAM_IN_FLIGHT.track(provider=provider), span("upstream", provider=provider, service=service, location=location):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            UPSTREAM_ERRORS.inc(provider=provider, service=service, location=location)
+            raise
+        finally:
+            UPSTREAM_REQUESTS.observe(time.perf_counter() - start, provider=provider, service=service, location=location)
+
+
+class MetricsMiddleware:
+    # plain ASGI middleware - unlike BaseHTTPMiddleware it does not pass streamed responses through another task
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+
+        async def send_observed(message):
+            if message["type"] == "http.response.start":
+                # router puts matched route to scope, so paths with no route share a single label value
+                path = getattr(scope.get("route"), "path", "other")
+                HTTP_REQUESTS.observe(
+                    time.perf_counter() - start, method=scope["method"], path=path, status=message["status"]
+                )
+            await send(message)
+
+        with HTTP_IN_FLIGHT.track():
+            await self.app(scope, receive, send_observed)
@@ -1,9 +1,15 @@
 from typing import AsyncGenerator, Dict, Iterable, List, Optional
 from enum import Enum
+from functools import lru_cache
 import jq
+import json
+import os
 import re
+import time
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+
+from backend.metrics import FILTER, FILTERED_RECORDS
 
 
 class Attribute(BaseModel):
@@ -27,51 +33,152 @@ class Op(Enum):
     NOT_CONTAINS = "not contains"
     LIKE = "like"
     NOT_LIKE = "not like"
+    IN = "in"  # val is a JSON list of values
 
 
-# todo tests
 class Label(BaseModel):
     key: str
     val: str
     op: Op
-    jq_key: Optional[str] = None
 
-    def matches(self, data: Dict) -> bool:
-        if not self.jq_key:
-            self.jq_key = jq.compile(self.key if self.key.startswith(".") else f".{self.key}")
+    @model_validator(mode="after")
+    def _check_values(self):
+        if self.op == Op.IN:
+            values = json.loads(self.val)
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise ValueError('Value of "in" label must be a JSON list of strings')
+        return self
 
-        results = [str(x) for x in self.jq_key.input_value(data).all() if x]
+    def values(self) -> List[str]:
+        return json.loads(self.val) if self.op == Op.IN else [self.val]
 
-        if self.op == Op.EQUALS:
-            return results and len(results) == 1 and results[0] == self.val
-        if self.op == Op.NOT_EQUALS:
-            return results and len(results) == 1 and results[0] != self.val
+    def matches(self, data: Dict) -> bool:
+        return _predicate(self.key, self.op, self.val).matches(data)
+
+    def filter(self, records: List[Dict]) -> List[Dict]:
+        return _predicate(self.key, self.op, self.val).filter(records)
+
+
+def filter_records(records: List[Dict], labels: Iterable[Label]) -> List[Dict]:
+    # evaluating one label at a time over all records, most selective first - so that later labels see only survivors
+    predicates = [_predicate(l.key, l.op, l.val) for l in labels]
+    for predicate in sorted(predicates, key=lambda p: p.pass_ratio()):
+        if not records:
+            break
+        records = predicate.filter(records)
+    return records
+
+
+# expected fraction of records passing a label, until we observe the real one
+_PRIOR_PASS_RATIO = {
+    Op.EQUALS: 0.1,
+    Op.IN: 0.1,
+    Op.CONTAINS: 0.2,
+    Op.LIKE: 0.3,
+    Op.NOT_LIKE: 0.7,
+    Op.NOT_CONTAINS: 0.8,
+    Op.NOT_EQUALS: 0.9,
+}
+
+
+class _Predicate:
+    # compiled form of a label - jq program and regex are built once and shared by all labels with same key, op and val
+    def __init__(self, key: str, op: Op, val: str):
+        key = key if key.startswith(".") else f".{key}"
+        self.program = jq.compile(key)
+        self.op = op
+        self.val = val
+        self.regex = re.compile(val) if op in {Op.LIKE, Op.NOT_LIKE} else None
+        self.values = frozenset(json.loads(val)) if op == Op.IN else None
+        self.seen = 0
+        self.passed = 0
+
+    def pass_ratio(self) -> float:
+        return self.passed / self.seen if self.seen else _PRIOR_PASS_RATIO[self.op]
+
+    def matches(self, data: Dict) -> bool:
+        return self._check(iter(self.program.input_value(data)))
+
+    def filter(self, records: List[Dict]) -> List[Dict]:
+        start = time.perf_counter()
+        result = [r for r in records if self.matches(r)]
+        self.seen += len(records)
+        self.passed += len(result)
+        FILTER.observe(time.perf_counter() - start, op=self.op.value)
+        FILTERED_RECORDS.inc(len(records), op=self.op.value)
+        return result
+
+    def _check(self, outputs) -> bool:
+        if self.op == Op.IN:
+            # any value in the set - values are compared as text join keys are (see backend.join), so that
+            # keys found by a join can be turned into this label
+            return any(
+                (x if isinstance(x, str) else json.dumps(x, separators=(",", ":"))) in self.values
+                for x in outputs if x is not None
+            )
+        # only truthy outputs count, and they are consumed lazily - we stop as soon as the answer is known
+        values = (str(x) for x in outputs if x)
         if self.op == Op.CONTAINS:
-            return results and len(results) > 0 and self.val in results
+            return any(v == self.val for v in values)
         if self.op == Op.NOT_CONTAINS:
-            return results and len(results) > 0 and self.val not in results
-        if self.op in {Op.LIKE, Op.NOT_LIKE}:
-            val_regex = re.compile(self.val)
-            if self.op == Op.LIKE:
-                return results and len(results) == 1 and bool(val_regex.match(results[0]))
-            if self.op == Op.NOT_LIKE:
-                return results and len(results) == 1 and not val_regex.match(results[0])
+            seen = False
+            for v in values:
+                if v == self.val:
+                    return False
+                seen = True
+            return seen
+        # remaining ops need exactly one value
+        value = next(values, None)
+        if value is None or next(values, None) is not None:
+            return False
+        if self.op == Op.EQUALS:
+            return value == self.val
+        if self.op == Op.NOT_EQUALS:
+            return value != self.val
+        if self.op == Op.LIKE:
+            return bool(self.regex.match(value))
+        if self.op == Op.NOT_LIKE:
+            return not self.regex.match(value)
         return False
 
 
+@lru_cache(maxsize=int(os.environ.get("SWAMP_PREDICATE_CACHE_SIZE", "1024")))
+def _predicate(key: str, op: Op, val: str) -> _Predicate:
+    return _Predicate(key, op, val)
+
+
+class Link(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    from_attr: str = Field(alias="fromAttr")
+    op: str = "=="
+    to_attr: str = Field(alias="toAttr")
+
+
+class GraphLink(Link):
+    # link between two vertices of a query graph
+    from_vertex: str = Field(alias="from")
+    to_vertex: str = Field(alias="to")
+
+
 _provider_registry = {}
 
 
 def _init_providers():
-    if not _provider_registry:
-        from backend.modules.aws import AWS
-        from backend.modules.k8s import Kubernetes 
+    # importing provider modules registers them, other providers (e.g. from tests) might already be registered
+    from backend.modules.aws import AWS
+    from backend.modules.k8s import Kubernetes
 
 def provider(name: str):
     _init_providers()
     return _provider_registry[name]
 
 
+async def close_providers():
+    for p in _provider_registry.values():
+        await p.close()
+
+
 def iter_all_resource_types() -> Iterable[ResourceType]:
     _init_providers()
     for p in _provider_registry:
@@ -123,6 +230,15 @@ class Provider(metaclass=_ProviderMeta):
     async def get(cls, resource: str, labels: Dict[str, Label]) -> AsyncGenerator[Dict, None]:
         pass
 
+    @classmethod
+    async def watch(cls, resource: str, labels: Dict[str, Label]) -> AsyncGenerator[Dict, None]:
+        raise GenericQueryException(f"Watching is not supported for resource {resource}")
+        yield  # makes it an async generator, same as get
+
+    @classmethod
+    async def close(cls):
+        pass
+
     @classmethod
     async def attributes(cls, resource: str) -> List[Attribute]:
         pass
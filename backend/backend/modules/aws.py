@@ -1,19 +1,47 @@
+import asyncio
+from collections import OrderedDict
 import configparser
+from contextlib import AsyncExitStack, asynccontextmanager
+import logging
 import os
-from typing import AsyncGenerator, Dict, List
+import re
+import time
+from typing import AsyncGenerator, Dict, List, Tuple
 
 import aioboto3
-import boto3
+from aiobotocore.config import AioConfig
+import botocore.session
+from functools import lru_cache
 from itertools import product
 import json
 
-from backend.model import Attribute, Label, Provider, GenericQueryException
-from backend.utils import get_matches
+from backend.cache import cached
+from backend.metrics import UPSTREAM_ITEMS, upstream_call
+from backend.model import Attribute, Label, Op, Provider, GenericQueryException
+from backend.tracing import span
+from backend.utils import get_matches, iter_concurrently
 
 
-class AWS(Provider):
-    _default_session = None
+# how many (profile, region) partitions are queried at once - in total and within a single profile
+_MAX_CONCURRENCY = int(os.environ.get("SWAMP_AWS_MAX_CONCURRENCY", "32"))
+_MAX_CONCURRENCY_PER_PROFILE = int(os.environ.get("SWAMP_AWS_MAX_CONCURRENCY_PER_PROFILE", "8"))
+# page size requested from paginated APIs (capped by the resource's own limit) and max items returned per partition,
+# 0 means service default / no limit - a partition cut off by the item limit is logged, its results are incomplete
+_PAGE_SIZE = int(os.environ.get("SWAMP_AWS_PAGE_SIZE", "1000"))
+_MAX_ITEMS = int(os.environ.get("SWAMP_AWS_MAX_ITEMS", "0"))
+# how many (profile, region, service) clients are kept open and for how many seconds an unused one stays open
+_CLIENT_POOL_SIZE = int(os.environ.get("SWAMP_AWS_CLIENT_POOL_SIZE", "64"))
+_CLIENT_IDLE_TIMEOUT = float(os.environ.get("SWAMP_AWS_CLIENT_IDLE_TIMEOUT", "300"))
+# retries are left to botocore - in "adaptive" mode every client (so every profile, region and service) has its own
+# token bucket that slows down when AWS throttles us, and its own retry quota that throttled calls draw from
+_RETRY_MODE = os.environ.get("SWAMP_AWS_RETRY_MODE", "adaptive")
+_MAX_RETRIES = int(os.environ.get("SWAMP_AWS_MAX_RETRIES", "10"))
+_CLIENT_CONFIG = AioConfig(retries={"mode": _RETRY_MODE, "max_attempts": _MAX_RETRIES})
+# how many levels of nested structures are expanded in generated examples
+_EXAMPLE_MAX_DEPTH = int(os.environ.get("SWAMP_AWS_EXAMPLE_MAX_DEPTH", "10"))
+
 
+class AWS(Provider):
     @staticmethod
     def provider_name() -> str:
         return "aws"
@@ -26,16 +54,10 @@ class AWS(Provider):
     def resources() -> List[str]:
         return list(_resources.keys())
     
-    @classmethod
-    def _get_default_session(cls):
-        if not cls._default_session:
-            cls._default_session = boto3.Session(profile_name=_get_profiles()[0])
-        return cls._default_session
-
     @classmethod
     def description(cls, r: str) -> str:
         client, shape = _resources[r]["client"], _resources[r]["shape"]
-        return cls._get_default_session().client(client).meta.service_model.shape_for(shape).documentation
+        return _service_model(client).shape_for(shape).documentation
     
     @classmethod
     def icon(cls, r: str) -> str:
@@ -51,22 +73,70 @@ class AWS(Provider):
         client = _resources[r]["client"]
         profiles = get_matches(profile_label,  _get_profiles())
         regions = get_matches(region_label, _ALL_AWS_REGIONS)
-        for profile, region in product(profiles, regions):
-            async for x in cls._single_get(client, r, profile, region):
+        params = _api_params(r, labels)
+        jobs = [
+            (
+                {"_aws_profile": profile, "_aws_region": region},
+                lambda profile=profile, region=region: cls._single_get(client, r, profile, region, params)
+            )
+            for profile, region in product(profiles, regions)
+        ]
+        async for x in iter_concurrently(jobs, _MAX_CONCURRENCY, _MAX_CONCURRENCY_PER_PROFILE, key="_aws_profile"):
+            yield x
+
+    @classmethod
+    async def _single_get(cls, client, r: str, profile: str, region: str, params: Dict) -> AsyncGenerator[Dict, None]:
+        key = (cls.provider_name(), r, profile, region, json.dumps(params, sort_keys=True))
+        with span("partition", provider="aws", resource=r, profile=profile, region=region):
+            async for x in cached(key, lambda: cls._fetch(client, r, profile, region, params)):
                 yield x
 
     @classmethod
-    async def _single_get(cls, client, r: str, profile: str, region: str) -> AsyncGenerator[Dict, None]:
-        async with aioboto3.Session(profile_name=profile, region_name=region).client(client) as client:
-            response = await _resources[r]["api_call"](client)
-            for item in _resources[r]["iter_items"](response):
-                item = json.loads(json.dumps(item, default=str))
-                yield {
-                    **{"_id": _resources[r]["get_id"](item)},
-                    "_aws_profile": profile,
-                    "_aws_region": region,
-                    **item
-                }
+    async def _fetch(cls, client, r: str, profile: str, region: str, params: Dict) -> AsyncGenerator[Dict, None]:
+        service = client
+        async with _CLIENT_POOL.client(profile, region, service) as client:
+            count = 0
+            try:
+                async for response in cls._iter_pages(client, r, params, service, region):
+                    for item in _resources[r]["iter_items"](response):
+                        if _MAX_ITEMS and count >= _MAX_ITEMS:
+                            logging.warning(f"{r} of {profile} in {region} has over {_MAX_ITEMS} items, rest is skipped")
+                            return
+                        count += 1
+                        item = _normalize(item)
+                        yield {
+                            **{"_id": _resources[r]["get_id"](item)},
+                            "_aws_profile": profile,
+                            "_aws_region": region,
+                            **item
+                        }
+            finally:
+                UPSTREAM_ITEMS.inc(count, provider="aws", service=service, location=region)
+
+    @classmethod
+    async def _iter_pages(cls, client, r: str, params: Dict, service: str, region: str) -> AsyncGenerator[Dict, None]:
+        operation = _resources[r]["operation"]
+        if not client.can_paginate(operation):
+            with upstream_call("aws", service, region):
+                response = await getattr(client, operation)(**params)
+            yield response
+            return
+        pagination_config = {"PageSize": _page_size(r)} if _PAGE_SIZE else {}
+        # not using async for, so that every page request is measured on its own
+        pages = client.get_paginator(operation).paginate(PaginationConfig=pagination_config, **params).__aiter__()
+        try:
+            while True:
+                with upstream_call("aws", service, region):
+                    page = await anext(pages, None)
+                if page is None:
+                    return
+                yield page
+        finally:
+            await pages.aclose()
+
+    @classmethod
+    async def close(cls):
+        await _CLIENT_POOL.close()
 
     @classmethod
     async def attributes(cls, r: str) -> List[Attribute]:
@@ -77,19 +147,44 @@ class AWS(Provider):
 
     @classmethod
     async def example(cls, r: str) -> Dict:
+        return cls._example(r)
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _example(cls, r: str) -> Dict:
         client, shape = _resources[r]["client"],_resources[r]["shape"]
-        shp = boto3.client(client).meta.service_model.shape_for(shape)
-        return cls._example_rec(shp, f"{cls.provider_name()}.{r}")
+        shp = _service_model(client).shape_for(shape)
+        return cls._example_rec(shp, f"{cls.provider_name()}.{r}", 0, {}, set())
 
     @classmethod
-    def _example_rec(cls, obj, n):
+    def _example_rec(cls, obj, n, depth, memo, visiting, cuts=None):
+        # every (structure, depth) is generated once and then shared, a structure is not expanded again
+        # inside itself and nothing goes deeper than _EXAMPLE_MAX_DEPTH;
+        # cuts are structures that were not expanded because of that - a subtree cut at an outer structure
+        # is only valid inside it, so it is not shared
+        cuts = [] if cuts is None else cuts
         if "type_name" in dir(obj) and obj.type_name == "structure":
-            return {
-                name: cls._example_rec(member, name)
-                for name, member in obj.members.items()
-            }
+            if depth >= _EXAMPLE_MAX_DEPTH:
+                return None
+            if obj.name in visiting:
+                cuts.append(obj.name)
+                return None
+            if (obj.name, depth) in memo:
+                return memo[(obj.name, depth)]
+            first_cut = len(cuts)
+            visiting.add(obj.name)
+            try:
+                example = {
+                    name: cls._example_rec(member, name, depth + 1, memo, visiting, cuts)
+                    for name, member in obj.members.items()
+                }
+            finally:
+                visiting.discard(obj.name)
+            if not any(c in visiting for c in cuts[first_cut:]):
+                memo[(obj.name, depth)] = example
+            return example
         elif "type_name" in dir(obj) and obj.type_name == "list":
-            el = cls._example_rec(obj.member, obj.name)
+            el = cls._example_rec(obj.member, obj.name, depth, memo, visiting, cuts)
             return [el, el]
         elif "type_name" in dir(obj) and obj.type_name in {"string", "boolean", "integer"}:
             return f"{n}_VALUE"
@@ -97,12 +192,152 @@ class AWS(Provider):
             return None
 
 
+@lru_cache(maxsize=None)
+def _service_model(service: str):
+    # service models ship with botocore, so there is no need for a client (or credentials) to read them
+    return botocore.session.get_session().get_service_model(service)
+
+
+class _PooledClient:
+    def __init__(self, ready: asyncio.Task):
+        self.ready = ready
+        self.users = 0
+        self.last_used = time.monotonic()
+
+
+class _ClientPool:
+    # keeps aioboto3 clients (and their HTTP connections) open between queries
+    def __init__(self, max_size: int, idle_timeout: float):
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._sessions: Dict[str, aioboto3.Session] = {}
+        self._clients: OrderedDict[Tuple[str, str, str], _PooledClient] = OrderedDict()
+        self._stacks: Dict[Tuple[str, str, str], AsyncExitStack] = {}
+
+    @asynccontextmanager
+    async def client(self, profile: str, region: str, service: str):
+        key = (profile, region, service)
+        entry = self._clients.get(key)
+        if entry is None:
+            entry = _PooledClient(asyncio.create_task(self._create(key)))
+            self._clients[key] = entry
+        self._clients.move_to_end(key)
+        entry.users += 1
+        try:
+            try:
+                if entry.ready.done():
+                    client = entry.ready.result()
+                else:
+                    with span("client", provider="aws", service=service, region=region):
+                        client = await asyncio.shield(entry.ready)
+            except Exception:
+                if self._clients.get(key) is entry:
+                    del self._clients[key]
+                raise
+            yield client
+        finally:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            await self._evict()
+
+    async def _create(self, key: Tuple[str, str, str]):
+        profile, region, service = key
+        if profile not in self._sessions:
+            self._sessions[profile] = aioboto3.Session(profile_name=profile)
+        stack = AsyncExitStack()
+        client = await stack.enter_async_context(self._sessions[profile].client(service, region_name=region, config=_CLIENT_CONFIG))
+        self._stacks[key] = stack
+        return client
+
+    async def _evict(self):
+        now = time.monotonic()
+        overflow = len(self._clients) - self._max_size
+        for key, entry in list(self._clients.items()):  # least recently used first
+            if entry.users or not entry.ready.done():
+                continue
+            if overflow > 0 or now - entry.last_used > self._idle_timeout:
+                overflow -= 1
+                del self._clients[key]
+                await self._close(key)
+
+    async def _close(self, key: Tuple[str, str, str]):
+        stack = self._stacks.pop(key, None)
+        if stack:
+            await stack.aclose()
+
+    async def close(self):
+        clients, self._clients = self._clients, OrderedDict()
+        for key, entry in clients.items():
+            if not entry.ready.done():
+                entry.ready.cancel()
+            await asyncio.gather(entry.ready, return_exceptions=True)
+            await self._close(key)
+        self._sessions.clear()
+
+
+_CLIENT_POOL = _ClientPool(_CLIENT_POOL_SIZE, _CLIENT_IDLE_TIMEOUT)
+
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def _normalize(value):
+    # botocore gives us datetimes (and bytes for blobs) - turning them into strings in place, as json default=str would
+    items = value.items() if isinstance(value, dict) else enumerate(value)
+    for k, v in items:
+        if isinstance(v, (dict, list)):
+            _normalize(v)
+        elif not isinstance(v, _JSON_SCALARS):
+            value[k] = str(v)
+    return value
+
+
+_TAG_VALUE_PATH = re.compile(r'^Tags\[\]\s*\|\s*select\(\s*\.Key\s*==\s*"([^"]+)"\s*\)\s*\|\s*\.Value$')
+
+
+def _page_size(r: str) -> int:
+    # APIs reject page sizes over their own limit (e.g. 100 route tables), max_page_size of the resource is that limit
+    return min(_PAGE_SIZE, _resources[r].get("max_page_size", _PAGE_SIZE))
+
+
+def _api_params(r: str, labels: Dict[str, Label]) -> Dict:
+    # translating labels to API call parameters, so that AWS does the filtering - anything that cannot be translated
+    # (or is translated only approximately, e.g. filter wildcards) is still checked locally by Label.matches
+    resource = _resources[r]
+    filters, list_params = {}, {}
+    for label in labels.values():
+        # "in" with no values matches nothing - an empty list means "any" (or is rejected) for the API
+        if label.op not in {Op.EQUALS, Op.CONTAINS, Op.IN} or not label.values():
+            continue
+        path = label.key.strip().removeprefix(".")
+        name = resource.get("filters", {}).get(path)
+        if not name and resource.get("tag_filters"):
+            tag_value = _TAG_VALUE_PATH.match(path)
+            if tag_value and label.op in {Op.EQUALS, Op.IN}:
+                name = f"tag:{tag_value.group(1)}"
+            elif path in {"Tags[].Key", "Tags[].Value"} and label.op in {Op.CONTAINS, Op.IN}:
+                name = "tag-key" if path == "Tags[].Key" else "tag-value"
+        if name:
+            filters.setdefault(name, label.values())
+        elif path in resource.get("list_params", {}):
+            list_params.setdefault(resource["list_params"][path], label.values())
+    if filters:
+        list_params[resource.get("filters_param", "Filters")] = [
+            {"Name": name, "Values": values} for name, values in sorted(filters.items())
+        ]
+    return list_params
+
+
 _PROFILES = []
+_PROFILES_MTIMES = None
 
 
 def _get_profiles():
-    global _PROFILES
-    if _PROFILES:
+    # read again whenever AWS config files change, so that every worker process ends up with the same profiles
+    global _PROFILES, _PROFILES_MTIMES
+    paths = [f"{os.environ['HOME']}/.aws/credentials", f"{os.environ['HOME']}/.aws/config"]
+    mtimes = tuple(os.stat(p).st_mtime if os.path.exists(p) else None for p in paths)
+    if _PROFILES and mtimes == _PROFILES_MTIMES:
         return _PROFILES
     credentials_parser = configparser.RawConfigParser()
     config_parser = configparser.RawConfigParser()
@@ -112,6 +347,7 @@ def _get_profiles():
     if os.path.exists(f"{os.environ['HOME']}/.aws/config"):
         with open (f"{os.environ['HOME']}/.aws/config", "r") as f:
             config_parser.read_file(f)
+    _PROFILES_MTIMES = mtimes
     _PROFILES = [
         *[section for section in credentials_parser.sections()],
         *["".join(section.split(" ")[1:]) for section in config_parser.sections() if section.startswith("profile ")]
@@ -161,211 +397,378 @@ _resources = {
     "vpc": {
         "client": "ec2",
         "shape": "Vpc",
-        "api_call": lambda c: c.describe_vpcs(),
+        "operation": "describe_vpcs",
         "iter_items": lambda r: r["Vpcs"],
-        "get_id": lambda i: i["VpcId"]
+        "get_id": lambda i: i["VpcId"],
+        "filters": {
+            "VpcId": "vpc-id",
+            "CidrBlock": "cidr",
+            "State": "state",
+            "OwnerId": "owner-id",
+            "DhcpOptionsId": "dhcp-options-id"
+        },
+        "tag_filters": True
     },
     "instance": {
         "client": "ec2",
         "shape": "Instance",
-        "api_call": lambda c: c.describe_instances(),
+        "operation": "describe_instances",
         "iter_items": lambda r: [inst for r2 in r.get("Reservations", []) for inst in r2.get("Instances")],
-        "get_id": lambda i: i["InstanceId"]
+        "get_id": lambda i: i["InstanceId"],
+        "filters": {
+            "InstanceId": "instance-id",
+            "VpcId": "vpc-id",
+            "SubnetId": "subnet-id",
+            "ImageId": "image-id",
+            "InstanceType": "instance-type",
+            "State.Name": "instance-state-name",
+            "PrivateIpAddress": "private-ip-address",
+            "PublicIpAddress": "ip-address",
+            "KeyName": "key-name",
+            "Placement.AvailabilityZone": "availability-zone",
+            "IamInstanceProfile.Arn": "iam-instance-profile.arn",
+            "SecurityGroups[].GroupId": "instance.group-id",
+            "NetworkInterfaces[].NetworkInterfaceId": "network-interface.network-interface-id"
+        },
+        "tag_filters": True
     },
     "subnet": {
         "client": "ec2",
         "shape": "Subnet",
-        "api_call": lambda c: c.describe_subnets(),
+        "operation": "describe_subnets",
         "iter_items": lambda r: r["Subnets"],
-        "get_id": lambda i: i["SubnetId"]
+        "get_id": lambda i: i["SubnetId"],
+        "filters": {
+            "SubnetId": "subnet-id",
+            "VpcId": "vpc-id",
+            "AvailabilityZone": "availability-zone",
+            "CidrBlock": "cidr-block",
+            "State": "state"
+        },
+        "tag_filters": True
     },
     "route_table": {
         "client": "ec2",
         "shape": "RouteTable",
-        "api_call": lambda c: c.describe_route_tables(),
+        "operation": "describe_route_tables",
         "iter_items": lambda r: r["RouteTables"],
-        "get_id": lambda i: i["RouteTableId"]
+        "get_id": lambda i: i["RouteTableId"],
+        "filters": {
+            "RouteTableId": "route-table-id",
+            "VpcId": "vpc-id",
+            "Associations[].SubnetId": "association.subnet-id",
+            "Routes[].GatewayId": "route.gateway-id",
+            "Routes[].NatGatewayId": "route.nat-gateway-id",
+            "Routes[].TransitGatewayId": "route.transit-gateway-id"
+        },
+        "tag_filters": True,
+        "max_page_size": 100
     },
     "internet_gateway": {
         "client": "ec2",
         "shape": "InternetGateway",
-        "api_call": lambda c: c.describe_internet_gateways(),
+        "operation": "describe_internet_gateways",
         "iter_items": lambda r: r["InternetGateways"],
-        "get_id": lambda i: i["InternetGatewayId"]
+        "get_id": lambda i: i["InternetGatewayId"],
+        "filters": {
+            "InternetGatewayId": "internet-gateway-id",
+            "Attachments[].VpcId": "attachment.vpc-id"
+        },
+        "tag_filters": True
     },
     "security_group": {
         "client": "ec2",
         "shape": "SecurityGroup",
-        "api_call": lambda c: c.describe_security_groups(),
+        "operation": "describe_security_groups",
         "iter_items": lambda r: r["SecurityGroups"],
-        "get_id": lambda i: i["GroupId"]
+        "get_id": lambda i: i["GroupId"],
+        "filters": {
+            "GroupId": "group-id",
+            "GroupName": "group-name",
+            "VpcId": "vpc-id"
+        },
+        "tag_filters": True
     },
     "nat_gateway": {
         "client": "ec2",
         "shape": "NatGateway",
-        "api_call": lambda c: c.describe_nat_gateways(),
+        "operation": "describe_nat_gateways",
         "iter_items": lambda r: r["NatGateways"],
-        "get_id": lambda i: i["NatGatewayId"]
+        "get_id": lambda i: i["NatGatewayId"],
+        "filters": {
+            "NatGatewayId": "nat-gateway-id",
+            "VpcId": "vpc-id",
+            "SubnetId": "subnet-id",
+            "State": "state"
+        },
+        "tag_filters": True,
+        "filters_param": "Filter"
     },
     "elastic_ip": {
         "client": "ec2",
         "shape": "Address",
-        "api_call": lambda c: c.describe_addresses(),
+        "operation": "describe_addresses",
         "iter_items": lambda r: r["Addresses"],
-        "get_id": lambda i: i["AllocationId"]
+        "get_id": lambda i: i["AllocationId"],
+        "filters": {
+            "AllocationId": "allocation-id",
+            "PublicIp": "public-ip",
+            "InstanceId": "instance-id",
+            "NetworkInterfaceId": "network-interface-id",
+            "AssociationId": "association-id"
+        },
+        "tag_filters": True
     },
     "eni": {
         "client": "ec2",
         "shape": "NetworkInterface",
-        "api_call": lambda c: c.describe_network_interfaces(),
+        "operation": "describe_network_interfaces",
         "iter_items": lambda r: r["NetworkInterfaces"],
-        "get_id": lambda i: i["NetworkInterfaceId"]
+        "get_id": lambda i: i["NetworkInterfaceId"],
+        "filters": {
+            "NetworkInterfaceId": "network-interface-id",
+            "VpcId": "vpc-id",
+            "SubnetId": "subnet-id",
+            "Attachment.InstanceId": "attachment.instance-id",
+            "PrivateIpAddress": "private-ip-address",
+            "Groups[].GroupId": "group-id",
+            "Status": "status"
+        },
+        "tag_filters": True
     },
     "network_acl": {
         "client": "ec2",
         "shape": "NetworkAcl",
-        "api_call": lambda c: c.describe_network_acls(),
+        "operation": "describe_network_acls",
         "iter_items": lambda r: r["NetworkAcls"],
-        "get_id": lambda i: i["NetworkAclId"]
+        "get_id": lambda i: i["NetworkAclId"],
+        "filters": {
+            "NetworkAclId": "network-acl-id",
+            "VpcId": "vpc-id",
+            "Associations[].SubnetId": "association.subnet-id"
+        },
+        "tag_filters": True
     },
     "ami": {
         "client": "ec2",
         "shape": "Image",
-        "api_call": lambda c: c.describe_images(),
+        "operation": "describe_images",
         "iter_items": lambda r: r["Images"],
         "get_id": lambda i: i["ImageId"],
+        "filters": {
+            "ImageId": "image-id",
+            "Name": "name",
+            "OwnerId": "owner-id",
+            "State": "state"
+        },
+        "tag_filters": True,
     },
     "launch_template": {
         "client": "ec2",
         "shape": "PrefixList",
-        "api_call": lambda c: c.describe_launch_templates(),
+        "operation": "describe_launch_templates",
         "iter_items": lambda r: r["LaunchTemplates"],
         "get_id": lambda i: i["LaunchTemplateId"],
+        "filters": {
+            "LaunchTemplateName": "launch-template-name"
+        },
+        "tag_filters": True,
+        "max_page_size": 200
     },
     "prefix_list": {
         "client": "ec2",
         "shape": "PrefixList",
-        "api_call": lambda c: c.describe_prefix_lists(),
+        "operation": "describe_prefix_lists",
         "iter_items": lambda r: r["PrefixLists"],
         "get_id": lambda i: i["PrefixListId"],
+        "filters": {
+            "PrefixListId": "prefix-list-id",
+            "PrefixListName": "prefix-list-name"
+        },
     },
     "reserved_instances": {
         "client": "ec2",
         "shape": "ReservedInstances",
-        "api_call": lambda c: c.describe_reserved_instances(),
+        "operation": "describe_reserved_instances",
         "iter_items": lambda r: r["ReservedInstances"],
         "get_id": lambda i: i["ReservedInstancesId"],
+        "filters": {
+            "ReservedInstancesId": "reserved-instances-id",
+            "InstanceType": "instance-type",
+            "State": "state"
+        },
+        "tag_filters": True,
     },
     "snapshot": {
         "client": "ec2",
         "shape": "Snapshot",
-        "api_call": lambda c: c.describe_snapshots(),
+        "operation": "describe_snapshots",
         "iter_items": lambda r: r["Snapshots"],
         "get_id": lambda i: i["SnapshotId"],
+        "filters": {
+            "SnapshotId": "snapshot-id",
+            "VolumeId": "volume-id",
+            "OwnerId": "owner-id",
+            "State": "status"
+        },
+        "tag_filters": True,
     },
     "tgw_attachment": {
         "client": "ec2",
         "shape": "TransitGatewayAttachment",
-        "api_call": lambda c: c.describe_transit_gateway_attachments(),
+        "operation": "describe_transit_gateway_attachments",
         "iter_items": lambda r: r["TransitGatewayAttachments"],
         "get_id": lambda i: i["TransitGatewayAttachmentId"],
+        "filters": {
+            "TransitGatewayAttachmentId": "transit-gateway-attachment-id",
+            "TransitGatewayId": "transit-gateway-id",
+            "ResourceId": "resource-id",
+            "ResourceType": "resource-type",
+            "State": "state"
+        },
+        "tag_filters": True,
     },
     "tgw_route_table": {
         "client": "ec2",
         "shape": "TransitGatewayRouteTable",
-        "api_call": lambda c: c.describe_transit_gateway_route_tables(),
+        "operation": "describe_transit_gateway_route_tables",
         "iter_items": lambda r: r["TransitGatewayRouteTables"],
         "get_id": lambda i: i["TransitGatewayRouteTableId"],
+        "filters": {
+            "TransitGatewayRouteTableId": "transit-gateway-route-table-id",
+            "TransitGatewayId": "transit-gateway-id",
+            "State": "state"
+        },
+        "tag_filters": True,
     },
     "transit_gateway": {
         "client": "ec2",
         "shape": "TransitGateway",
-        "api_call": lambda c: c.describe_transit_gateways(),
+        "operation": "describe_transit_gateways",
         "iter_items": lambda r: r["TransitGateways"],
         "get_id": lambda i: i["TransitGatewayId"],
+        "filters": {
+            "TransitGatewayId": "transit-gateway-id",
+            "OwnerId": "owner-id",
+            "State": "state"
+        },
+        "tag_filters": True,
     },
     "volume": {
         "client": "ec2",
         "shape": "Volume",
-        "api_call": lambda c: c.describe_volumes(),
+        "operation": "describe_volumes",
         "iter_items": lambda r: r["Volumes"],
         "get_id": lambda i: i["VolumeId"],
+        "filters": {
+            "VolumeId": "volume-id",
+            "Attachments[].InstanceId": "attachment.instance-id",
+            "AvailabilityZone": "availability-zone",
+            "State": "status",
+            "VolumeType": "volume-type",
+            "SnapshotId": "snapshot-id"
+        },
+        "tag_filters": True,
     },
     "vpc_endpoint": {
         "client": "ec2",
         "shape": "VpcEndpoint",
-        "api_call": lambda c: c.describe_vpc_endpoints(),
+        "operation": "describe_vpc_endpoints",
         "iter_items": lambda r: r["VpcEndpoints"],
         "get_id": lambda i: i["VpcEndpointId"],
+        "filters": {
+            "VpcEndpointId": "vpc-endpoint-id",
+            "VpcId": "vpc-id",
+            "ServiceName": "service-name",
+            "State": "vpc-endpoint-state",
+            "VpcEndpointType": "vpc-endpoint-type"
+        },
+        "tag_filters": True,
     },
     "vpc_peering_connection": {
         "client": "ec2",
         "shape": "VpcPeeringConnection",
-        "api_call": lambda c: c.describe_vpc_peering_connections(),
+        "operation": "describe_vpc_peering_connections",
         "iter_items": lambda r: r["VpcPeeringConnections"],
         "get_id": lambda i: i["VpcPeeringConnectionId"],
+        "filters": {
+            "VpcPeeringConnectionId": "vpc-peering-connection-id",
+            "AccepterVpcInfo.VpcId": "accepter-vpc-info.vpc-id",
+            "RequesterVpcInfo.VpcId": "requester-vpc-info.vpc-id",
+            "Status.Code": "status-code"
+        },
+        "tag_filters": True,
     },
     "dx_connection": {
         "client": "directconnect",
         "shape": "Connection",
-        "api_call": lambda c: c.describe_connections(),
+        "operation": "describe_connections",
         "iter_items": lambda r: r["connections"],
         "get_id": lambda i: i["connectionId"]
     },
     "dx_lag": {
         "client": "directconnect",
         "shape": "Lag",
-        "api_call": lambda c: c.describe_lags(),
+        "operation": "describe_lags",
         "iter_items": lambda r: r["lags"],
         "get_id": lambda i: i["lagId"]
     },
     "dx_virtual_gateway": {
         "client": "directconnect",
         "shape": "VirtualGateway",
-        "api_call": lambda c: c.describe_virtual_gateways(),
+        "operation": "describe_virtual_gateways",
         "iter_items": lambda r: r["virtualGateways"],
         "get_id": lambda i: i["virtualGatewayId"]
     },
     "dx_virtual_interface": {
         "client": "directconnect",
         "shape": "VirtualInterface",
-        "api_call": lambda c: c.describe_virtual_interfaces(),
+        "operation": "describe_virtual_interfaces",
         "iter_items": lambda r: r["virtualInterfaces"],
         "get_id": lambda i: i["virtualInterfaceId"]
     },
     "resolver_endpoint": {
         "client": "route53resolver",
         "shape": "ResolverEndpoint",
-        "api_call": lambda c: c.list_resolver_endpoints(),
+        "operation": "list_resolver_endpoints",
         "iter_items": lambda r: r["ResolverEndpoints"],
-        "get_id": lambda i: i["Id"]
+        "get_id": lambda i: i["Id"],
+        "max_page_size": 100
     },
     "resolver_rule": {
         "client": "route53resolver",
         "shape": "ResolverRule",
-        "api_call": lambda c: c.list_resolver_rules(),
+        "operation": "list_resolver_rules",
         "iter_items": lambda r: r["ResolverRules"],
-        "get_id": lambda i: i["Id"]
+        "get_id": lambda i: i["Id"],
+        "max_page_size": 100
     },
     "autoscaling_group": {
         "client": "autoscaling",
         "shape": "AutoScalingGroup",
-        "api_call": lambda c: c.describe_auto_scaling_groups(),
+        "operation": "describe_auto_scaling_groups",
         "iter_items": lambda r: r["AutoScalingGroups"],
-        "get_id": lambda i: i["AutoScalingGroupName"]
+        "get_id": lambda i: i["AutoScalingGroupName"],
+        "max_page_size": 100,
+        "list_params": {
+            "AutoScalingGroupName": "AutoScalingGroupNames"
+        },
+        "tag_filters": True
     },
     "load_balancer": {
         "client": "elbv2",
         "shape": "LoadBalancer",
-        "api_call": lambda c: c.describe_load_balancers(),
+        "operation": "describe_load_balancers",
         "iter_items": lambda r: r["LoadBalancers"],
-        "get_id": lambda i: i["LoadBalancerArn"]
+        "get_id": lambda i: i["LoadBalancerArn"],
+        "max_page_size": 400
     },
     "target_group": {
         "client": "elbv2",
         "shape": "TargetGroup",
-        "api_call": lambda c: c.describe_target_groups(),
+        "operation": "describe_target_groups",
         "iter_items": lambda r: r["TargetGroups"],
-        "get_id": lambda i: i["TargetGroupArn"]
+        "get_id": lambda i: i["TargetGroupArn"],
+        "max_page_size": 400
     },
 }
@@ -1,69 +1,169 @@
-from typing import AsyncGenerator, Dict, List
+import asyncio
+from contextlib import asynccontextmanager
+import os
+import re
+import time
+from typing import AsyncGenerator, Callable, Dict, List, Set, Tuple
 
 from kubernetes_asyncio import config
+from kubernetes_asyncio.client.exceptions import ApiException
 from kubernetes_asyncio.dynamic import DynamicClient
-import requests
+import logging
+import orjson
 from typing import Optional
 
-from backend.model import Attribute, Label, Provider, GenericQueryException
-from backend.utils import get_matches
+from backend.cache import cached, max_stale
+from backend.metrics import UPSTREAM_ITEMS, upstream_call
+from backend.model import Attribute, Label, Op, Provider, GenericQueryException
+from backend.snapshot import multi_worker, snapshot_store
+from backend.tracing import span
+from backend.utils import get_matches, iter_concurrently
 
 
 description = "Module for interacting with Kubernetes resources"
 
 
-# TODO: should be schema for each context
-_OPENAPI_SCHEMA = None
+# how many API calls are made at once - in total and against a single context
+_MAX_CONCURRENCY = int(os.environ.get("SWAMP_K8S_MAX_CONCURRENCY", "16"))
+_MAX_CONCURRENCY_PER_CONTEXT = int(os.environ.get("SWAMP_K8S_MAX_CONCURRENCY_PER_CONTEXT", "8"))
+# if at least this fraction of context's namespaces is selected, we list the resource cluster-wide once
+# and filter namespaces on our side instead of listing every namespace separately
+_CLUSTER_WIDE_RATIO = float(os.environ.get("SWAMP_K8S_CLUSTER_WIDE_RATIO", "0.5"))
+# how many seconds a pooled client is reused - it keeps credentials it got when created and exec-based tokens expire
+_CLIENT_MAX_AGE = float(os.environ.get("SWAMP_K8S_CLIENT_MAX_AGE", "600"))
+# opt-in: queried resources are kept in memory and up to date with list+watch, instead of being listed on every query
+_WATCH = os.environ.get("SWAMP_K8S_WATCH", "").lower() in {"1", "true", "yes"}
+# for how many seconds a watched resource is kept up to date after it was last queried
+_WATCH_IDLE_TIMEOUT = float(os.environ.get("SWAMP_K8S_WATCH_IDLE_TIMEOUT", "600"))
+# watch requests are renewed this often (in seconds) - it is also how often idle watches notice they can stop
+_WATCH_TIMEOUT = 60
+# how many levels of nested definitions are expanded in generated examples
+_EXAMPLE_MAX_DEPTH = int(os.environ.get("SWAMP_K8S_EXAMPLE_MAX_DEPTH", "10"))
 
 
-async def _generate_example_from_openapi_schema(openapi_path: str) -> Dict:
-    global _OPENAPI_SCHEMA
-    if not _OPENAPI_SCHEMA:
-        _OPENAPI_SCHEMA = await _load_openapi_schema()
-    definition = _OPENAPI_SCHEMA["definitions"][openapi_path]
-    return _generate_example_rec(_OPENAPI_SCHEMA, definition, openapi_path)
+async def _generate_example_from_openapi_schema(api_version: str, openapi_path: str) -> Dict:
+    # TODO: selecting default context for now, but resource might not exist there!
+    examples = await _load_examples(None, api_version, openapi_path)
+    return examples.example(openapi_path)
 
 
-async def _load_openapi_schema():
-    async with await config.new_client_from_config() as api:
-        client = await DynamicClient(api)
-        # we cannot get schema with normal client, so making primitive request to API server's openapi endpoint
-        cfg = client.configuration
-        response = None
-        if cfg.api_key:
-            headers = {"authorization": cfg.api_key["BearerToken"] if "BearerToken" in cfg.api_key else cfg.api_key["authorization"]}
-            response = requests.get(f"{cfg.host}/openapi/v2", headers=headers, verify=cfg.ssl_ca_cert)
-        else:
-            response = requests.get(f"{cfg.host}/openapi/v2", cert=(cfg.cert_file, cfg.key_file), verify=cfg.ssl_ca_cert)
-        assert response.status_code // 100 == 2
-        return response.json()
-
-
-def _generate_example_rec(schema, definition, name) -> Dict:
-    properties = definition.get("properties")
-    if properties:
-        return {
-            key: _process_val(schema, key, val)
-            for key, val in properties.items()
-            if key not in {"apiVersion", "kind"}
-        }
-    else:
-        return f"{name}_VALUE"
-
-
-def _process_val(schema, key, val):
-    if "$ref" in val:
-        new_definition = schema["definitions"][val["$ref"].replace("#/definitions/", "")]
-        return _generate_example_rec(schema, new_definition, key)
-    elif val["type"] == "array":
-        if "$ref" in val["items"]:
-            new_definition = schema["definitions"][val["items"]["$ref"].replace("#/definitions/", "")]
-            el = _generate_example_rec(schema, new_definition, key)
-            return [el, el]
+# example generators (with definitions they use) by server relative URL of openapi v3 document (it contains hash
+# of its contents), or by (context, server version) for the whole openapi v2 schema
+_SCHEMAS: Dict[Tuple, asyncio.Task] = {}
+
+
+async def _load_examples(context: Optional[str], api_version: str, openapi_path: str) -> "_ExampleGenerator":
+    async with _CLIENT_POOL.client(context) as pooled:
+        api = pooled.client.client
+        if pooled.openapi_paths is None:
+            try:
+                pooled.openapi_paths = (await _get_json(api, "/openapi/v3"))["paths"]
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+                pooled.openapi_paths = {}
+        group_path = f"apis/{api_version}" if "/" in api_version else f"api/{api_version}"
+        if group_path in pooled.openapi_paths:
+            # only the document of resource's api group, it is way smaller than the whole schema
+            url = pooled.openapi_paths[group_path]["serverRelativeURL"]
+            examples = await _cached_schema((url,), lambda: _get_json(api, url), "components", "schemas")
+            if openapi_path in examples.definitions:
+                return examples
+        # server without openapi v3 (or the definition is not in group's document) - falling back to the whole schema
+        if pooled.server_version is None:
+            pooled.server_version = (await _get_json(api, "/version"))["gitVersion"]
+        return await _cached_schema((context, pooled.server_version), lambda: _get_json(api, "/openapi/v2"), "definitions")
+
+
+async def _cached_schema(key: Tuple, fetch: Callable, *path: str) -> "_ExampleGenerator":
+    async def load():
+        schema = await fetch()
+        for p in path:
+            schema = schema[p]
+        return _ExampleGenerator(schema)
+
+    if key not in _SCHEMAS:
+        _SCHEMAS[key] = asyncio.create_task(load())
+    task = _SCHEMAS[key]
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        if _SCHEMAS.get(key) is task:
+            del _SCHEMAS[key]
+        raise
+
+
+async def _get_json(api, path: str):
+    # schema documents are big, so we skip the client's deserialization and read plain JSON
+    response = await api.call_api(
+        path, "GET", header_params={"Accept": "application/json"}, auth_settings=["BearerToken"], _preload_content=False
+    )
+    try:
+        if response.status // 100 != 2:
+            raise ApiException(status=response.status, reason=response.reason)
+        return orjson.loads(await response.read())
+    finally:
+        response.release()
+
+
+class _ExampleGenerator:
+    # every (definition, depth) is generated once and then shared - by resources and by repeated references;
+    # a definition is not expanded again inside itself and nothing goes deeper than _EXAMPLE_MAX_DEPTH
+    def __init__(self, definitions: Dict[str, Dict]):
+        self.definitions = definitions
+        self._memo: Dict[Tuple[str, int], Dict] = {}
+        self._visiting: Set[str] = set()
+        # definitions that were not expanded because they were met inside themselves - a subtree cut at an outer
+        # definition is only valid inside it, so it is not shared
+        self._cuts: List[str] = []
+
+    def example(self, name: str) -> Dict:
+        if name not in self.definitions:
+            raise GenericQueryException(f"Schema of {name} was not found")
+        return self._definition(name, name, 0)
+
+    def _definition(self, name: str, key: str, depth: int):
+        properties = self.definitions[name].get("properties")
+        if not properties or depth >= _EXAMPLE_MAX_DEPTH:
+            return f"{key}_VALUE"
+        if name in self._visiting:
+            self._cuts.append(name)
+            return f"{key}_VALUE"
+        if (name, depth) in self._memo:
+            return self._memo[(name, depth)]
+        first_cut = len(self._cuts)
+        self._visiting.add(name)
+        try:
+            example = {
+                k: self._value(k, val, depth + 1)
+                for k, val in properties.items()
+                if k not in {"apiVersion", "kind"}
+            }
+        finally:
+            self._visiting.discard(name)
+        if not any(c in self._visiting for c in self._cuts[first_cut:]):
+            self._memo[(name, depth)] = example
+        return example
+
+    def _value(self, key: str, val: Dict, depth: int):
+        if "allOf" in val:  # openapi v3 wraps references that come with e.g. description or default
+            val = val["allOf"][0]
+        if "$ref" in val:
+            return self._definition(_ref_name(val["$ref"]), key, depth)
+        elif val.get("type") == "array":
+            items = val["items"].get("allOf", [val["items"]])[0]
+            if "$ref" in items:
+                el = self._definition(_ref_name(items["$ref"]), key, depth)
+                return [el, el]
+            else:
+                return [f"{key}_VALUE", f"{key}_VALUE"]
         else:
-            return [f"{key}_VALUE", f"{key}_VALUE"]
-    else:
-        return f"{key}_VALUE"
+            return f"{key}_VALUE"
+
+
+def _ref_name(ref: str) -> str:
+    # "#/definitions/<name>" in openapi v2, "#/components/schemas/<name>" in v3
+    return ref.rsplit("/", 1)[-1]
 
 
 class Kubernetes(Provider):
@@ -104,40 +204,84 @@ class Kubernetes(Provider):
     
     @classmethod
     async def example(cls, r: str) -> Dict:
-        # TODO: selecting default context for now, but resource might not exist there! 
-        # we should go over contexts and see which one has this resource
-        result = await _generate_example_from_openapi_schema(_resources[r]["openapi_path"])
+        # TODO: we should go over contexts and see which one has this resource
+        result = await _generate_example_from_openapi_schema(_resources[r]["api_version"], _resources[r]["openapi_path"])
         return result
 
+    @classmethod
+    async def close(cls):
+        _INFORMERS.reset()
+        await _CLIENT_POOL.close()
+
     @classmethod
     async def get(cls, r: str, labels: Dict[str, Label]) -> AsyncGenerator[Dict, None]:
-        namespaced = _resources[r]["namespaced"]
-        if "_k8s_context" not in labels:
-            raise GenericQueryException("You need to provide _k8s_context value to query K8S resource")
-        if namespaced and "_k8s_namespace" not in labels:
-            raise GenericQueryException("You need to provide _k8s_namespace value to query K8S resource")
-        context_label = labels["_k8s_context"]
-        contexts = get_matches(context_label,  await _get_contexts())
-        args_list = contexts
-        if namespaced:
-            namespace_label = labels["_k8s_namespace"]
-            args_list = [(context, ns) for context in contexts for ns in get_matches(namespace_label,  await _get_namespaces(context))]
-        for args in args_list:
-            async for x in cls._single_get(r, *args):
+        selectors = _selectors(r, labels)
+        jobs = await _jobs(
+            r, labels,
+            single=lambda context, ns=None: cls._single_get(r, context, selectors, ns),
+            cluster_wide=lambda context, namespaces: cls._cluster_wide_get(r, context, selectors, namespaces),
+        )
+        async for x in iter_concurrently(jobs, _MAX_CONCURRENCY, _MAX_CONCURRENCY_PER_CONTEXT, key="_k8s_context"):
+            yield x
+
+    @classmethod
+    async def watch(cls, r: str, labels: Dict[str, Label]) -> AsyncGenerator[Dict, None]:
+        if not _WATCH:
+            raise GenericQueryException("Watching K8S resources needs SWAMP_K8S_WATCH to be enabled")
+        jobs = await _jobs(
+            r, labels,
+            single=lambda context, ns=None: _watch_events(r, context, ns),
+            cluster_wide=lambda context, namespaces: _watch_events(r, context, None, namespaces),
+        )
+        # every job streams forever, so all of them have to run at once
+        async for x in iter_concurrently(jobs, max(len(jobs), 1)):
+            yield x
+
+    @classmethod
+    async def _cluster_wide_get(cls, r: str, context: str, selectors: Dict[str, str], namespaces: List[str]):
+        allowed_namespaces = set(namespaces)
+        try:
+            async for x in cls._single_get(r, context, selectors, cluster_wide=True):
+                if x["_k8s_namespace"] in allowed_namespaces:
+                    yield x
+        except ApiException as e:
+            if e.status != 403:
+                raise
+            # not allowed to list across namespaces - falling back to listing them one by one
+            jobs = [
+                ({"_k8s_context": context, "_k8s_namespace": ns}, lambda ns=ns: cls._single_get(r, context, selectors, ns))
+                for ns in namespaces
+            ]
+            async for x in iter_concurrently(jobs, _MAX_CONCURRENCY_PER_CONTEXT):
+                yield x
+
+    @classmethod
+    async def _single_get(cls, r: str, context: str, selectors: Dict[str, str], namespace: Optional[str] = None, cluster_wide: bool = False):
+        if _WATCH:
+            # selectors are not needed, everything gets filtered by labels anyway
+            informer = await _INFORMERS.get(r, context, namespace)
+            for x in list(informer.items.values()):
+                yield x
+            return
+        key = (cls.provider_name(), r, context, namespace, cluster_wide, tuple(sorted(selectors.items())))
+        with span("partition", provider="k8s", resource=r, context=context, namespace=namespace or "*"):
+            async for x in cached(key, lambda: cls._fetch(r, context, selectors, namespace, cluster_wide)):
                 yield x
 
     @classmethod
-    async def _single_get(cls, r: str, context: str, namespace: Optional[str] = None):
-        async with await config.new_client_from_config(context=context) as api:
-            client = await DynamicClient(api)
-            v1 = await client.resources.get(api_version=_resources[r]["api_version"], kind=_resources[r]["kind"])
-            kwargs, extra_return_values = {}, {}
+    async def _fetch(cls, r: str, context: str, selectors: Dict[str, str], namespace: Optional[str] = None, cluster_wide: bool = False):
+        async with _CLIENT_POOL.client(context) as pooled:
+            v1 = await pooled.resource(_resources[r]["api_version"], _resources[r]["kind"])
+            kwargs, extra_return_values = {**selectors}, {}
             if namespace:
                 kwargs["namespace"] = namespace
                 extra_return_values["_k8s_namespace"] = namespace
-            response = await v1.get(**kwargs)
-            print(kwargs)
+            with upstream_call("k8s", _resources[r]["kind"], context):
+                response = await v1.get(**kwargs)
+            UPSTREAM_ITEMS.inc(len(response.items), provider="k8s", service=_resources[r]["kind"], location=context)
             for item in response.items:
+                if cluster_wide:
+                    extra_return_values["_k8s_namespace"] = item.metadata.namespace
                 yield {
                     "_id": item.metadata.name,
                     "_k8s_context": context,
@@ -146,11 +290,336 @@ class Kubernetes(Provider):
                 }
 
 
+async def _jobs(r: str, labels: Dict[str, Label], single: Callable, cluster_wide: Callable) -> List[Tuple[Dict[str, str], Callable]]:
+    # splitting query into partitions - one per context, or per namespace of a context (unless most of them are selected)
+    namespaced = _resources[r]["namespaced"]
+    if "_k8s_context" not in labels:
+        raise GenericQueryException("You need to provide _k8s_context value to query K8S resource")
+    if namespaced and "_k8s_namespace" not in labels:
+        raise GenericQueryException("You need to provide _k8s_namespace value to query K8S resource")
+    context_label = labels["_k8s_context"]
+    contexts = get_matches(context_label,  await _get_contexts())
+    if not namespaced:
+        return [({"_k8s_context": context}, lambda context=context: single(context)) for context in contexts]
+    namespace_label = labels["_k8s_namespace"]
+    all_namespaces = await _get_namespaces_of_contexts(contexts)
+    jobs = []
+    for context in contexts:
+        namespaces = get_matches(namespace_label, all_namespaces[context])
+        if len(namespaces) > 1 and len(namespaces) >= _CLUSTER_WIDE_RATIO * len(all_namespaces[context]):
+            jobs.append((
+                {"_k8s_context": context},
+                lambda context=context, namespaces=namespaces: cluster_wide(context, namespaces)
+            ))
+        else:
+            jobs.extend((
+                {"_k8s_context": context, "_k8s_namespace": ns},
+                lambda context=context, ns=ns: single(context, ns)
+            ) for ns in namespaces)
+    return jobs
+
+
+async def _watch_events(r: str, context: str, namespace: Optional[str], namespaces: Optional[List[str]] = None):
+    try:
+        informer = await _INFORMERS.get(r, context, namespace)
+    except ApiException as e:
+        if e.status != 403 or namespaces is None:
+            raise
+        # not allowed to watch across namespaces - falling back to watching them one by one
+        jobs = [({"_k8s_context": context, "_k8s_namespace": ns}, lambda ns=ns: _watch_events(r, context, ns)) for ns in namespaces]
+        async for event in iter_concurrently(jobs, len(jobs)):
+            yield event
+        return
+    allowed_namespaces = set(namespaces) if namespaces is not None else None
+    async for event in informer.events():
+        if allowed_namespaces is None or "result" not in event or event["result"]["_k8s_namespace"] in allowed_namespaces:
+            yield event
+
+
+class _Informer:
+    # local copy of resources of a (context, kind, namespace) - listed once, then kept up to date with watch
+    def __init__(self, r: str, context: str, namespace: Optional[str]):
+        self.r = r
+        self.context = context
+        self.namespace = namespace
+        self.items: Dict[str, Dict] = {}
+        self.ready = asyncio.get_running_loop().create_future()
+        self.last_used = time.monotonic()
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def stopped(self) -> bool:
+        return self._task.done()
+
+    async def _run(self):
+        resource_version, failures = None, 0
+        while self._subscribers or time.monotonic() - self.last_used < _WATCH_IDLE_TIMEOUT:
+            try:
+                async with _CLIENT_POOL.client(self.context) as pooled:
+                    v1 = await pooled.resource(_resources[self.r]["api_version"], _resources[self.r]["kind"])
+                    if resource_version is None:
+                        with upstream_call("k8s", _resources[self.r]["kind"], self.context):
+                            response = await v1.get(namespace=self.namespace)
+                        resource_version = response.metadata.resourceVersion
+                        self._replace([self._record(item.to_dict()) for item in response.items])
+                        if not self.ready.done():
+                            self.ready.set_result(None)
+                    async for event in v1.watch(namespace=self.namespace, resource_version=resource_version, timeout=_WATCH_TIMEOUT):
+                        resource_version = event["raw_object"]["metadata"]["resourceVersion"]
+                        if event["type"] in {"ADDED", "MODIFIED", "DELETED"}:
+                            self._apply(event["type"].lower(), self._record(event["raw_object"]))
+                failures = 0
+            except asyncio.CancelledError:
+                if not self.ready.done():
+                    self.ready.set_exception(RuntimeError("Watch was stopped"))
+                raise
+            except Exception as e:
+                if not self.ready.done():
+                    self.ready.set_exception(e)
+                    return
+                if isinstance(e, ApiException) and e.status == 410:
+                    # our resourceVersion is too old to continue watching from, listing everything again
+                    resource_version = None
+                    continue
+                logging.exception(e)
+                failures += 1
+                await asyncio.sleep(min(2 ** failures, _WATCH_TIMEOUT))
+
+    def _record(self, item: Dict) -> Dict:
+        extra_return_values = {}
+        if _resources[self.r]["namespaced"]:
+            extra_return_values["_k8s_namespace"] = item["metadata"].get("namespace", self.namespace)
+        return {"_id": item["metadata"]["name"], "_k8s_context": self.context, **extra_return_values, **item}
+
+    def _replace(self, records: List[Dict]):
+        # after (re)listing, subscribers only get to know about what changed since the last known state
+        items = {x["metadata"]["uid"]: x for x in records}
+        for uid, x in self.items.items():
+            if uid not in items:
+                self._publish({"type": "deleted", "result": x})
+        for uid, x in items.items():
+            previous = self.items.get(uid)
+            if previous is None:
+                self._publish({"type": "added", "result": x})
+            elif previous["metadata"].get("resourceVersion") != x["metadata"].get("resourceVersion"):
+                self._publish({"type": "modified", "result": x})
+        self.items = items
+
+    def _apply(self, event_type: str, record: Dict):
+        if event_type == "deleted":
+            self.items.pop(record["metadata"]["uid"], None)
+        else:
+            self.items[record["metadata"]["uid"]] = record
+        self._publish({"type": event_type, "result": record})
+
+    def _publish(self, event: Optional[Dict]):
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    async def events(self) -> AsyncGenerator[Dict, None]:
+        # everything known so far as "added" events, then changes as they come
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        try:
+            for x in list(self.items.values()):
+                yield {"type": "added", "result": x}
+            yield {"type": "synced"}
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            self._subscribers.discard(queue)
+            self.last_used = time.monotonic()
+
+    def stop(self):
+        self._task.cancel()
+        self._publish(None)
+
+
+class _Informers:
+    def __init__(self):
+        self._informers: Dict[Tuple[str, str, Optional[str]], _Informer] = {}
+
+    async def get(self, r: str, context: str, namespace: Optional[str]) -> _Informer:
+        key = (r, context, namespace)
+        informer = self._informers.get(key)
+        if informer is None or informer.stopped:
+            informer = self._informers[key] = _Informer(r, context, namespace)
+        informer.last_used = time.monotonic()
+        try:
+            await asyncio.shield(informer.ready)
+        except Exception:
+            if self._informers.get(key) is informer:
+                del self._informers[key]
+            raise
+        return informer
+
+    def reset(self):
+        # not waiting for informers to stop - this might be called from one of them (when it checks kubeconfig)
+        informers, self._informers = list(self._informers.values()), {}
+        for informer in informers:
+            informer.stop()
+
+
+_INFORMERS = _Informers()
+
+
+class _PooledClient:
+    def __init__(self, ready: asyncio.Task):
+        self.ready = ready
+        self.users = 0
+        self.created = time.monotonic()
+        self.retired = False
+        self.client: Optional[DynamicClient] = None
+        self.openapi_paths: Optional[Dict[str, Dict]] = None
+        self.server_version: Optional[str] = None
+        self._resources = {}
+
+    async def resource(self, api_version: str, kind: str):
+        # resource discovery costs round-trips to API server, so it is done once per pooled client
+        key = (api_version, kind)
+        if key not in self._resources:
+            self._resources[key] = await self.client.resources.get(api_version=api_version, kind=kind)
+        return self._resources[key]
+
+
+class _ClientPool:
+    # keeps a ready DynamicClient per context, dropping all of them when kubeconfig changes
+    def __init__(self, max_age: float):
+        self._max_age = max_age
+        self._clients: Dict[Optional[str], _PooledClient] = {}
+        self._kubeconfig_mtimes = None
+
+    @asynccontextmanager
+    async def client(self, context: Optional[str]):
+        await self.check_kubeconfig()
+        entry = self._clients.get(context)
+        if entry is not None and time.monotonic() - entry.created > self._max_age:
+            await self._retire(context)
+            entry = None
+        if entry is None:
+            entry = _PooledClient(asyncio.create_task(self._create(context)))
+            self._clients[context] = entry
+        entry.users += 1
+        try:
+            try:
+                if entry.ready.done():
+                    entry.client = entry.ready.result()
+                else:
+                    with span("client", provider="k8s", context=str(context)):
+                        entry.client = await asyncio.shield(entry.ready)
+            except Exception:
+                if self._clients.get(context) is entry:
+                    del self._clients[context]
+                raise
+            try:
+                yield entry
+            except ApiException as e:
+                if e.status == 401:  # most likely an expired token, next query will get a fresh client
+                    await self._retire(context)
+                raise
+        finally:
+            entry.users -= 1
+            if entry.retired and not entry.users:
+                await self._close(entry)
+
+    async def _create(self, context: Optional[str]) -> DynamicClient:
+        api = await config.new_client_from_config(context=context)
+        try:
+            return await DynamicClient(api)
+        except Exception:
+            await api.close()
+            raise
+
+    async def check_kubeconfig(self):
+        mtimes = _kubeconfig_mtimes()
+        if self._kubeconfig_mtimes is not None and mtimes != self._kubeconfig_mtimes:
+            global _CONTEXTS
+            _CONTEXTS = []
+            _CONTEXT_TO_NAMESPACES.clear()
+            _INFORMERS.reset()
+            for context in list(self._clients):
+                await self._retire(context)
+        self._kubeconfig_mtimes = mtimes
+
+    async def _retire(self, context: Optional[str]):
+        entry = self._clients.pop(context, None)
+        if entry is None:
+            return
+        entry.retired = True
+        if not entry.users:
+            await self._close(entry)
+
+    async def _close(self, entry: _PooledClient):
+        if not entry.ready.done():
+            entry.ready.cancel()
+        results = await asyncio.gather(entry.ready, return_exceptions=True)
+        if isinstance(results[0], DynamicClient):
+            await results[0].client.close()
+
+    async def close(self):
+        for context in list(self._clients):
+            entry = self._clients.pop(context)
+            await self._close(entry)
+
+
+def _kubeconfig_mtimes() -> Tuple:
+    paths = config.kube_config.KUBE_CONFIG_DEFAULT_LOCATION.split(os.pathsep)
+    return tuple(os.stat(p).st_mtime if os.path.exists(p) else None for p in map(os.path.expanduser, paths))
+
+
+_CLIENT_POOL = _ClientPool(_CLIENT_MAX_AGE)
+
+
+_LABEL_PATH = re.compile(r'^metadata\.labels(?:\.([A-Za-z0-9_]+)|\.?\["([^"]+)"\]|\."([^"]+)")$')
+_LABEL_KEY = re.compile(r"^([a-z0-9]([-a-z0-9.]*[a-z0-9])?/)?[A-Za-z0-9]([-A-Za-z0-9_.]*[A-Za-z0-9])?$")
+_LABEL_VALUE = re.compile(r"^([A-Za-z0-9]([-A-Za-z0-9_.]*[A-Za-z0-9])?)?$")
+# every kind supports these, anything else has to be listed in resource's "field_selectors"
+_COMMON_FIELD_SELECTORS = {"metadata.name", "metadata.namespace"}
+
+
+def _selectors(r: str, labels: Dict[str, Label]) -> Dict[str, str]:
+    # translating labels to label/field selectors, so that API server does the filtering -
+    # anything that cannot be translated is still checked locally by Label.matches
+    label_selector, field_selector = [], []
+    supported_fields = _COMMON_FIELD_SELECTORS | set(_resources[r].get("field_selectors", []))
+    for label in labels.values():
+        # "in" with no values matches nothing - there is no selector for that, it is left to Label.matches
+        if label.op not in {Op.EQUALS, Op.NOT_EQUALS, Op.IN} or not label.values():
+            continue
+        op = "=" if label.op == Op.EQUALS else "!="
+        path = label.key.strip().removeprefix(".")
+        if path == "_id":
+            path = "metadata.name"
+        label_path = _LABEL_PATH.match(path)
+        if label_path:
+            key = next(g for g in label_path.groups() if g)
+            values = label.values()
+            if _LABEL_KEY.match(key) and all(len(v) <= 63 and _LABEL_VALUE.match(v) for v in values):
+                if label.op == Op.IN:
+                    label_selector.append(f"{key} in ({','.join(values)})")
+                else:
+                    label_selector.append(f"{key}{op}{label.val}")
+        elif path in supported_fields and label.op != Op.IN:  # field selectors have no set-based operators
+            val = label.val.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=")
+            field_selector.append(f"{path}{op}{val}")
+    selectors = {}
+    if label_selector:
+        selectors["label_selector"] = ",".join(label_selector)
+    if field_selector:
+        selectors["field_selector"] = ",".join(field_selector)
+    return selectors
+
+
 _CONTEXTS = []
 
 
 async def _get_contexts():
     global _CONTEXTS
+    await _CLIENT_POOL.check_kubeconfig()
     if _CONTEXTS:
         return _CONTEXTS
     await config.load_kube_config()
@@ -165,18 +634,39 @@ _CONTEXT_TO_NAMESPACES = {}
 async def _get_namespaces(context):
     if context in _CONTEXT_TO_NAMESPACES:
         return _CONTEXT_TO_NAMESPACES[context]
+    store = snapshot_store()
+    if store is not None and (max_stale() is not None or multi_worker()):
+        snapshot = await store.load_metadata(f"k8s_namespaces:{context}")
+        # namespaces listed before kubeconfig changed might be of a different cluster
+        if snapshot is not None and snapshot[0] >= max(filter(None, _kubeconfig_mtimes()), default=0):
+            if multi_worker():
+                # listed by another worker - all of them use the same namespaces then
+                _CONTEXT_TO_NAMESPACES[context] = snapshot[1]
+            return snapshot[1]
     try:
-        async with await config.new_client_from_config(context=context) as api:
-            client = await DynamicClient(api)
-            v1 = await client.resources.get(api_version="v1", kind="Namespace")
-            response = await v1.get()
+        async with _CLIENT_POOL.client(context) as pooled:
+            v1 = await pooled.resource("v1", "Namespace")
+            with upstream_call("k8s", "Namespace", context):
+                response = await v1.get()
             namespaces = [it.metadata.name for it in response.items]
             _CONTEXT_TO_NAMESPACES[context] = namespaces
     except config.config_exception.ConfigException:
         raise GenericQueryException(f"Invalid context {context}")
+    if store is not None:
+        await store.save_metadata(f"k8s_namespaces:{context}", namespaces)
     return _CONTEXT_TO_NAMESPACES[context]
 
 
+async def _get_namespaces_of_contexts(contexts: List[str]) -> Dict[str, List[str]]:
+    semaphore = asyncio.Semaphore(_MAX_CONCURRENCY)
+
+    async def get_one(context):
+        async with semaphore:
+            return await _get_namespaces(context)
+
+    return dict(zip(contexts, await asyncio.gather(*(get_one(c) for c in contexts))))
+
+
 _resources = {
     "config_map": {
         "kind": "ConfigMap",
@@ -187,14 +677,14 @@ _resources = {
     },
     "replica_set": {
         "kind": "ReplicaSet",
-        "api_version": "v1",
+        "api_version": "apps/v1",
         "openapi_path": "io.k8s.api.apps.v1.ReplicaSet",
         "description": "Replica set",
         "namespaced": True,
     },
     "deployment": {
         "kind": "Deployment",
-        "api_version": "v1",
+        "api_version": "apps/v1",
         "openapi_path": "io.k8s.api.apps.v1.Deployment",
         "description": "Deployment",
         "namespaced": True,
@@ -205,6 +695,7 @@ _resources = {
         "openapi_path": "io.k8s.api.core.v1.Pod",
         "description": "Pod",
         "namespaced": True,
+        "field_selectors": ["spec.nodeName", "spec.restartPolicy", "spec.schedulerName", "spec.serviceAccountName", "status.phase", "status.podIP", "status.nominatedNodeName"],
     },
     "pvc": {
         "kind": "PersistentVolumeClaim",
@@ -219,6 +710,7 @@ _resources = {
         "openapi_path": "io.k8s.api.core.v1.Secret",
         "description": "Secret",
         "namespaced": True,
+        "field_selectors": ["type"],
     },
     "service_account": {
         "kind": "ServiceAccount",
@@ -240,6 +732,7 @@ _resources = {
         "openapi_path": "io.k8s.api.core.v1.Event",
         "description": "Event",
         "namespaced": True,
+        "field_selectors": ["involvedObject.kind", "involvedObject.namespace", "involvedObject.name", "involvedObject.uid", "involvedObject.apiVersion", "involvedObject.fieldPath", "reason", "reportingComponent", "type"],
     },
     "endpoints": {
         "kind": "Endpoints",
@@ -0,0 +1,69 @@
+import asyncio
+from collections import defaultdict
+import json
+import os
+from typing import Awaitable, Callable, Dict, List, Sequence
+
+from backend.join import extract_keys
+from backend.model import GenericQueryException, GraphLink, Label, Op
+
+
+# a link narrows down the query of its target with at most this many keys - with more of them the target is queried
+# as it is (filters that long would not be pushed down anyway) and joined afterwards
+_MAX_KEYS = int(os.environ.get("SWAMP_PLAN_MAX_KEYS", "100"))
+# every target item linked by these has (one of) its keys among keys of the source items
+_NARROWING_OPS = {"=", "==", "contains"}
+
+
+def plan(vertices: Sequence[str], links: Sequence[GraphLink]) -> Dict[str, int]:
+    # picks the link (index) that feeds keys into each vertex's query - the vertex waits for its source to finish;
+    # only vertices with a single incoming link get one (with more, an item needs to be reachable by any of them,
+    # which a label cannot express), and links closing a cycle are just joined at the end
+    if len(set(vertices)) != len(vertices):
+        raise GenericQueryException("Vertex ids must be unique")
+    incoming = defaultdict(list)
+    for i, link in enumerate(links):
+        if link.from_vertex not in vertices or link.to_vertex not in vertices:
+            raise GenericQueryException(f"Link {link.from_vertex} -> {link.to_vertex} refers to unknown vertex")
+        incoming[link.to_vertex].append(i)
+    feeders = {}
+    for v in vertices:
+        if len(incoming[v]) != 1 or links[incoming[v][0]].op not in _NARROWING_OPS:
+            continue
+        source = links[incoming[v][0]].from_vertex
+        while source in feeders and source != v:
+            source = links[feeders[source]].from_vertex
+        if source != v:
+            feeders[v] = incoming[v][0]
+    return feeders
+
+
+async def execute(
+    vertices: Sequence[str],
+    links: Sequence[GraphLink],
+    query: Callable[[str, List[Label]], Awaitable[List[Dict]]],
+) -> Dict[str, List[Dict]]:
+    # runs query(vertex, extra labels) for every vertex - as soon as its source (if any) is done,
+    # so that independent branches of the graph run concurrently
+    feeders = plan(vertices, links)
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(v: str) -> List[Dict]:
+        extra = []
+        if v in feeders:
+            link = links[feeders[v]]
+            source = await tasks[link.from_vertex]
+            keys = sorted({k for ks in await asyncio.to_thread(extract_keys, source, link.from_attr) for k in ks})
+            if not keys:
+                return []  # nothing to link to
+            if len(keys) <= _MAX_KEYS:
+                extra.append(Label(key=link.to_attr, op=Op.IN, val=json.dumps(keys)))
+        return await query(v, extra)
+
+    for v in vertices:
+        tasks[v] = asyncio.create_task(run(v))
+    try:
+        return dict(zip(tasks, await asyncio.gather(*tasks.values())))
+    finally:
+        for task in tasks.values():
+            task.cancel()
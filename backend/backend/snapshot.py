@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import orjson
+
+
+# number of server processes (see backend.main.start) - with more than one, the store is how they share results,
+# so it is always used then
+_WORKERS = int(os.environ.get("SWAMP_WORKERS", "1"))
+# where snapshots are kept (nothing is persisted if not set) and for how many seconds they are worth keeping;
+# several workers need the store, by default it is then in user's cache directory
+_PATH = os.environ.get("SWAMP_SNAPSHOT_PATH") or (
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "swamp", "snapshots.sqlite")
+    if _WORKERS > 1 else None
+)
+_MAX_AGE = float(os.environ.get("SWAMP_SNAPSHOT_MAX_AGE", str(7 * 24 * 3600)))
+
+
+class SnapshotStore:
+    # last known results of every partition (and some metadata, e.g. namespaces of contexts), persisted in SQLite
+    # so that they survive restarts; sqlite3 is blocking, so every call goes to a worker thread
+    def __init__(self, path: str, max_age: float):
+        self._path = path
+        self._max_age = max_age
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS partitions (key TEXT PRIMARY KEY, fetched_at REAL, items BLOB)")
+            db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, fetched_at REAL, value BLOB)")
+            # partitions being fetched right now, so that other processes wait for the result instead of fetching it too
+            db.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+            db.execute("DELETE FROM partitions WHERE fetched_at < ?", (time.time() - max_age,))
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self._path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _read(self, query: str, key: str) -> Optional[Tuple[float, Any]]:
+        with self._connect() as db:
+            row = db.execute(query, (key, time.time() - self._max_age)).fetchone()
+        return (row[0], orjson.loads(row[1])) if row else None
+
+    def _write(self, query: str, key: str, value: Any):
+        with self._connect() as db:
+            db.execute(query, (key, time.time(), orjson.dumps(value, default=str)))
+
+    async def load(self, key: Hashable) -> Optional[Tuple[float, List[Dict]]]:
+        query = "SELECT fetched_at, items FROM partitions WHERE key = ? AND fetched_at >= ?"
+        return await asyncio.to_thread(self._read, query, _key(key))
+
+    async def fetched_at(self, key: Hashable) -> Optional[float]:
+        # cheap check of whether a snapshot changed - without reading its items
+        def read():
+            with self._connect() as db:
+                row = db.execute(
+                    "SELECT fetched_at FROM partitions WHERE key = ? AND fetched_at >= ?",
+                    (_key(key), time.time() - self._max_age)
+                ).fetchone()
+            return row[0] if row else None
+        return await asyncio.to_thread(read)
+
+    async def save(self, key: Hashable, items: List[Dict]):
+        query = "INSERT OR REPLACE INTO partitions (key, fetched_at, items) VALUES (?, ?, ?)"
+        await asyncio.to_thread(self._write, query, _key(key), items)
+
+    async def load_metadata_with_prefix(self, prefix: str, max_age: float) -> Dict[str, Tuple[float, Any]]:
+        def read():
+            with self._connect() as db:
+                rows = db.execute(
+                    "SELECT name, fetched_at, value FROM metadata WHERE substr(name, 1, ?) = ? AND fetched_at >= ?",
+                    (len(prefix), prefix, time.time() - max_age)
+                ).fetchall()
+            return {name: (fetched_at, orjson.loads(value)) for name, fetched_at, value in rows}
+        return await asyncio.to_thread(read)
+
+    async def load_metadata(self, name: str) -> Optional[Tuple[float, Any]]:
+        query = "SELECT fetched_at, value FROM metadata WHERE name = ? AND fetched_at >= ?"
+        return await asyncio.to_thread(self._read, query, name)
+
+    async def save_metadata(self, name: str, value: Any):
+        query = "INSERT OR REPLACE INTO metadata (name, fetched_at, value) VALUES (?, ?, ?)"
+        await asyncio.to_thread(self._write, query, name, value)
+
+
+    async def claim(self, key: Hashable, duration: float) -> bool:
+        # takes the lease of a partition unless another process holds it (and it did not expire)
+        def claim():
+            now = time.time()
+            with self._connect() as db:
+                cursor = db.execute(
+                    "INSERT INTO leases (key, owner, expires) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE "
+                    "SET owner = excluded.owner, expires = excluded.expires WHERE leases.expires < ?",
+                    (_key(key), _owner(), now + duration, now)
+                )
+                return cursor.rowcount == 1
+        return await asyncio.to_thread(claim)
+
+    async def release(self, key: Hashable):
+        def release():
+            with self._connect() as db:
+                db.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (_key(key), _owner()))
+        await asyncio.to_thread(release)
+
+
+def _owner() -> str:
+    return str(os.getpid())
+
+
+def _key(key: Hashable) -> str:
+    return orjson.dumps(key).decode()
+
+
+def _create_private(path: str):
+    # whole items (secrets included) end up in the store, so nobody but its owner can read it - sqlite creates
+    # its -wal and -shm files with the same permissions
+    os.makedirs(os.path.dirname(path) or ".", mode=0o700, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        if os.fstat(fd).st_uid != os.getuid():
+            raise PermissionError(f"{path} is owned by another user")
+        os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+
+
+def _open_store() -> Optional[SnapshotStore]:
+    if not _PATH:
+        return None
+    try:
+        _create_private(_PATH)
+        return SnapshotStore(_PATH, _MAX_AGE)
+    except (OSError, sqlite3.Error) as e:
+        logging.exception(e)
+        return None
+
+
+_SNAPSHOT_STORE = _open_store()
+
+
+def snapshot_store() -> Optional[SnapshotStore]:
+    return _SNAPSHOT_STORE
+
+
+def multi_worker() -> bool:
+    return _WORKERS > 1 and _SNAPSHOT_STORE is not None
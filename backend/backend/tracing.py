@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+# spans over this limit are only counted, so that a query over hundreds of partitions does not produce a huge header
+_MAX_SPANS = int(os.environ.get("SWAMP_TRACE_MAX_SPANS", "200"))
+
+
+class Trace:
+    # timeline of a single request - spans are appended by every task working on it, they all share this object
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float, float, Dict[str, str]]] = []
+        self.dropped = 0
+
+    def add(self, name: str, start: float, end: float, attributes: Dict[str, str]):
+        if len(self.spans) >= _MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append((name, start - self.start, end - start, attributes))
+
+    def to_dicts(self) -> List[Dict]:
+        spans = [
+            {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(duration * 1000, 3), **attributes}
+            for name, start, duration, attributes in sorted(self.spans, key=lambda s: s[1])
+        ]
+        return spans + ([{"name": "dropped", "count": self.dropped}] if self.dropped else [])
+
+    def server_timing(self) -> str:
+        # Server-Timing header (shown by browser dev tools) - it has no start times, so they go to description
+        entries = [f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}"]
+        for name, start, duration, attributes in sorted(self.spans, key=lambda s: s[1]):
+            description = " ".join([*(f"{k}={v}" for k, v in attributes.items()), f"@{start * 1000:.1f}ms"])
+            description = description.replace("\\", "\\\\").replace('"', '\\"')
+            entries.append(f'{name};dur={duration * 1000:.1f};desc="{description}"')
+        if self.dropped:
+            entries.append(f'dropped;desc="{self.dropped} spans"')
+        return ", ".join(entries)
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def trace_requested(header: Optional[str]) -> bool:
+    return (header or "").strip().lower() in {"1", "true", "yes"}
+
+
+@contextmanager
+def tracing(enabled: bool):
+    # while active (and enabled), spans of the current task and tasks it starts are recorded to the yielded trace
+    if not enabled:
+        yield None
+        return
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes: str):
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        attributes["error"] = "error"
+        raise
+    finally:
+        trace.add(name, start, time.perf_counter(), attributes)
@@ -1,4 +1,10 @@
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
 import re
+from typing import AsyncGenerator, Callable, Dict, Iterable, Optional, Tuple
 
 from backend.model import Label, Op
 
@@ -8,8 +14,78 @@ def get_matches(label: Label, allowed_values):
         return [v for v in allowed_values if v == label.val]
     if label.op == Op.NOT_EQUALS or label.op == Op.NOT_CONTAINS:
         return [v for v in allowed_values if v != label.val]
+    if label.op == Op.IN:
+        values = set(label.values())
+        return [v for v in allowed_values if v in values]
     r = re.compile(label.val)
     if label.op == Op.LIKE:
         return [v for v in allowed_values if r.match(v)]
     if label.op == Op.NOT_LIKE:
         return [v for v in allowed_values if not r.match(v)]
+
+
+_DONE = object()
+
+_partition_listener: ContextVar[Optional[Callable[[Dict], None]]] = ContextVar("partition_listener", default=None)
+
+
+@contextmanager
+def partition_events(listener: Callable[[Dict], None]):
+    # while active, iter_concurrently reports progress of every partition to the listener,
+    # and a failing partition is reported to it instead of failing the whole query
+    token = _partition_listener.set(listener)
+    try:
+        yield
+    finally:
+        _partition_listener.reset(token)
+
+
+async def iter_concurrently(
+    jobs: Iterable[Tuple[Dict[str, str], Callable[[], AsyncGenerator[Dict, None]]]],
+    limit: int,
+    per_key_limit: Optional[int] = None,
+    key: Optional[str] = None,
+) -> AsyncGenerator[Dict, None]:
+    # runs every (partition, generator factory) job concurrently and yields items in the order they arrive,
+    # at most `limit` jobs at once and at most `per_key_limit` jobs sharing the same partition[key]
+    queue = asyncio.Queue()
+    total = asyncio.Semaphore(limit)
+    per_key = defaultdict(lambda: asyncio.Semaphore(per_key_limit or limit))
+    listener = _partition_listener.get()
+
+    async def run(partition, factory):
+        count = 0
+        try:
+            # taking the per-key slot first, so that a busy key does not hold global slots while it waits
+            async with per_key[partition.get(key)], total:
+                if listener:
+                    listener({"status": "started", "partition": partition})
+                async for item in factory():
+                    count += 1
+                    await queue.put(item)
+            if listener:
+                listener({"status": "done", "partition": partition, "count": count})
+            await queue.put(_DONE)
+        except Exception as e:
+            if not listener:
+                await queue.put(e)
+                return
+            logging.exception(e)
+            listener({"status": "error", "partition": partition, "count": count, "detail": str(e)})
+            await queue.put(_DONE)
+
+    tasks = [asyncio.create_task(run(partition, factory)) for partition, factory in jobs]
+    try:
+        pending = len(tasks)
+        while pending:
+            item = await queue.get()
+            if item is _DONE:
+                pending -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
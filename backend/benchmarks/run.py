@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import base64
+import datetime
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import orjson
+
+from backend.main import _STREAM_FORMATS, app, dump_json
+from backend.model import Label, close_providers, filter_records
+from benchmarks import standins, synthetic
+
+
+_RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+# relative change of a metric that is reported as regression
+_THRESHOLD = 0.1
+
+
+async def request(path: str, labels: Iterable[Tuple[str, str, str]], headers: Optional[Dict[str, str]] = None,
+                  **params: str) -> Tuple[int, bytes]:
+    # calls the app directly through ASGI - whole request handling (routing, labels parsing, serialization) is included,
+    # only the network is not
+    encode = lambda s: base64.b64encode(s.encode()).decode()
+    query = urlencode([*params.items(), *((",".join(map(encode, l)), "") for l in labels)])
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "server": ("bench", 80), "client": ("bench", 1),
+    }
+    response = {"status": None, "body": []}
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if requested:
+            # same as a server - nothing comes after the body until client disconnects
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return response["status"], b"".join(response["body"])
+
+
+def _stats(timings: List[float]) -> Dict[str, float]:
+    timings = sorted(timings)
+    return {
+        "min_s": timings[0],
+        "median_s": statistics.median(timings),
+        "p95_s": timings[min(len(timings) - 1, round(0.95 * (len(timings) - 1)))],
+    }
+
+
+async def _get_latency(provider: str, resource: str, labels: List[Tuple[str, str, str]], repeat: int) -> Dict[str, float]:
+    # cold - every partition is fetched from upstream again, warm - everything comes from result cache
+    results = {}
+    for name, headers in [("cold", {"Cache-Control": "no-cache"}), ("warm", {})]:
+        timings, size, count = [], 0, 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            status, body = await request("/get", labels, headers, _provider=provider, _resource=resource)
+            timings.append(time.perf_counter() - start)
+            if status != 200:
+                raise RuntimeError(f"/get returned {status}: {body[:500]}")
+            size, count = len(body), len(orjson.loads(body)["results"])
+        results.update({f"{name}_{k}": v for k, v in _stats(timings).items()})
+    return {**results, "results": count, "response_mb": size / 2 ** 20}
+
+
+async def _get_memory(provider: str, resource: str, labels: List[Tuple[str, str, str]]) -> Dict[str, float]:
+    # high-water mark of python allocations during a single cold /get, measured separately as tracing slows it down
+    tracemalloc.start()
+    try:
+        await request("/get", labels, {"Cache-Control": "no-cache"}, _provider=provider, _resource=resource)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_mb": peak / 2 ** 20}
+
+
+def _throughput(f: Callable[[], object], count: int, repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        timings.append(time.perf_counter() - start)
+    return {**_stats(timings), "items_per_s": count / statistics.median(timings)}
+
+
+_REGIONS = ("_synthetic_region", "like", ".*")
+_NAMESPACES = ("_synthetic_namespace", "like", ".*")
+_TEAM = ('.Tags[] | select(.Key == "team") | .Value', "==", "payments")
+_FILTERS = {
+    "equals": [_TEAM],
+    "like": [(".InstanceType", "like", "^(t3|m5)\\..*")],
+    "not_contains": [(".NetworkInterfaces[].Groups[].GroupId", "not contains", "sg-00000001")],
+    "in": [(".SubnetId", "in", orjson.dumps([f"subnet-{i:08x}" for i in range(0, 200, 4)]).decode())],
+    "combined": [_TEAM, (".State.Name", "==", "running"), (".InstanceType", "like", "^(t3|m5)\\..*")],
+}
+
+
+async def bench_synthetic(repeat: int) -> Dict[str, Dict[str, float]]:
+    # generating inventory is not what we measure
+    for r, partitions in [("instance", synthetic.regions()), ("pod", synthetic.namespaces())]:
+        for p in partitions:
+            synthetic.inventory(r, p)
+    return {
+        "get.synthetic.instance": await _get_latency("synthetic", "instance", [_REGIONS], repeat),
+        "get.synthetic.instance.filtered": await _get_latency("synthetic", "instance", [_REGIONS, _TEAM], repeat),
+        "get.synthetic.pod": await _get_latency("synthetic", "pod", [_NAMESPACES], repeat),
+        "memory.get.synthetic.instance": await _get_memory("synthetic", "instance", [_REGIONS]),
+    }
+
+
+async def bench_filters(repeat: int) -> Dict[str, Dict[str, float]]:
+    records = [x for region in synthetic.regions() for x in synthetic.inventory("instance", region)]
+    results = {}
+    for name, labels in _FILTERS.items():
+        labels = [Label(key=k, op=op, val=val) for k, op, val in labels]
+        results[f"filter.{name}"] = _throughput(lambda: filter_records(records, labels), len(records), repeat)
+    return results
+
+
+async def bench_serialization(repeat: int) -> Dict[str, Dict[str, float]]:
+    records = [x for region in synthetic.regions() for x in synthetic.inventory("instance", region)]
+    _, encode = _STREAM_FORMATS["ndjson"]
+    return {
+        "serialize.json": _throughput(lambda: dump_json({"results": records, "errors": []}), len(records), repeat),
+        "serialize.ndjson": _throughput(
+            lambda: [encode({"type": "result", "result": r}) for r in records], len(records), repeat
+        ),
+    }
+
+
+async def bench_aws(repeat: int) -> Dict[str, Dict[str, float]]:
+    instances = int(os.environ.get("SWAMP_BENCH_AWS_INSTANCES", "2000"))
+    with standins.moto_aws(instances) as profile:
+        labels = [("_aws_profile", "==", profile), ("_aws_region", "==", "us-east-1")]
+        return {"get.aws.instance": await _get_latency("aws", "instance", labels, repeat)}
+
+
+async def bench_k8s(repeat: int) -> Dict[str, Dict[str, float]]:
+    with standins.fake_kubernetes():
+        labels = [("_k8s_context", "==", "bench"), ("_k8s_namespace", "like", ".*")]
+        return {
+            "get.k8s.pod": await _get_latency("k8s", "pod", labels, repeat),
+            "get.k8s.pod.namespace": await _get_latency(
+                "k8s", "pod", [labels[0], ("_k8s_namespace", "==", "namespace-0")], repeat
+            ),
+        }
+
+
+_SUITES = {
+    "synthetic": bench_synthetic,
+    "filters": bench_filters,
+    "serialization": bench_serialization,
+    "aws": bench_aws,
+    "k8s": bench_k8s,
+}
+
+
+async def run(suites: List[str], repeat: int) -> Tuple[Dict[str, Dict[str, float]], Dict[str, str]]:
+    results, skipped = {}, {}
+    for name in suites:
+        print(f"running {name}...", flush=True)
+        try:
+            results.update(await _SUITES[name](repeat))
+        except standins.Unavailable as e:
+            skipped[name] = str(e)
+        finally:
+            await close_providers()
+    return results, skipped
+
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _load(ref: str) -> Dict:
+    # either path to results file or a commit that has results stored
+    path = ref if os.path.exists(ref) else os.path.join(_RESULTS_DIR, f"{_git('rev-parse', '--short', ref) or ref}.json")
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def compare(baseline: Dict, current: Dict) -> List[str]:
+    # lower is better for times and memory, higher is better for throughput
+    lines = []
+    for name, metrics in current["benchmarks"].items():
+        for metric, value in metrics.items():
+            before = baseline["benchmarks"].get(name, {}).get(metric)
+            if not before or not metric.endswith(("_s", "_mb")):
+                continue
+            change = value / before - 1
+            worse = -change if metric.endswith("_per_s") else change
+            flag = "REGRESSION" if worse > _THRESHOLD else "improved" if worse < -_THRESHOLD else ""
+            lines.append(f"{name:40} {metric:16} {before:12.4f} -> {value:12.4f} {change:+8.1%} {flag}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs swamp backend benchmarks and stores results under commit hash")
+    parser.add_argument("suites", nargs="*", help=f"any of: {', '.join(_SUITES)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare", help="commit (or results file) to compare with")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+    if set(args.suites) - set(_SUITES):
+        parser.error(f"unknown suites: {', '.join(set(args.suites) - set(_SUITES))}")
+
+    results, skipped = asyncio.run(run(args.suites or list(_SUITES), args.repeat))
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    report = {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "settings": {k: v for k, v in os.environ.items() if k.startswith("SWAMP_")},
+        # includes generated inventory, so it is only a rough upper bound
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10,
+        "skipped": skipped,
+        "benchmarks": results,
+    }
+    for name, metrics in results.items():
+        print(f"{name:40} " + "  ".join(f"{k}={v:.4g}" for k, v in metrics.items()))
+    for name, reason in skipped.items():
+        print(f"{name:40} skipped: {reason}")
+    if not args.no_save:
+        os.makedirs(_RESULTS_DIR, exist_ok=True)
+        path = os.path.join(_RESULTS_DIR, f"{commit}.json")
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        print(f"results stored in {path}")
+    if args.compare:
+        print("\n".join(compare(_load(args.compare), report)))
+
+
+if __name__ == "__main__":
+    main()
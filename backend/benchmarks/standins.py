@@ -0,0 +1,178 @@
+import asyncio
+from contextlib import contextmanager
+import os
+import socket
+import tempfile
+import threading
+from typing import Dict, Iterator, List
+
+from aiohttp import web
+from kubernetes_asyncio import config
+import orjson
+
+from benchmarks import synthetic
+
+
+class Unavailable(Exception):
+    # stand-in cannot run here (e.g. moto is not installed), benchmarks using it are skipped
+    pass
+
+
+@contextmanager
+def _patched_env(**values: str) -> Iterator[None]:
+    previous = {k: os.environ.get(k) for k in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for k, v in previous.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def moto_aws(instances: int, region: str = "us-east-1") -> Iterator[str]:
+    # moto server with given number of EC2 instances, real AWS provider talks to it through "bench" profile;
+    # yields name of the profile
+    try:
+        import boto3
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise Unavailable("moto is not installed (pip install 'moto[server]')")
+    port = _free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    try:
+        with tempfile.TemporaryDirectory() as home:
+            os.makedirs(f"{home}/.aws")
+            with open(f"{home}/.aws/credentials", "w") as f:
+                f.write("[bench]\naws_access_key_id = bench\naws_secret_access_key = bench\n")
+            ec2 = boto3.client(
+                "ec2", region_name=region, endpoint_url=endpoint, aws_access_key_id="bench", aws_secret_access_key="bench"
+            )
+            image = ec2.describe_images()["Images"][0]["ImageId"]
+            for start in range(0, instances, 1000):
+                count = min(1000, instances - start)
+                ec2.run_instances(ImageId=image, MinCount=count, MaxCount=count, TagSpecifications=[
+                    {"ResourceType": "instance", "Tags": [{"Key": "team", "Value": "payments"}]}
+                ])
+            with _patched_env(HOME=home, AWS_ENDPOINT_URL=endpoint):
+                from backend.modules import aws
+                aws._PROFILES = []
+                try:
+                    yield "bench"
+                finally:
+                    aws._PROFILES = []
+    finally:
+        server.stop()
+
+
+def _camel(value):
+    # synthetic pods use python client (snake case) names, API server speaks camel case
+    if isinstance(value, dict):
+        return {
+            k.split("_")[0] + "".join(p.title() for p in k.split("_")[1:]): _camel(v)
+            for k, v in value.items() if not k.startswith("_")
+        }
+    if isinstance(value, list):
+        return [_camel(v) for v in value]
+    return value
+
+
+class _FakeApiServer:
+    # just enough of K8S API for discovery and listing namespaces and pods - selectors are ignored,
+    # the provider filters everything again anyway
+    def __init__(self, namespaces: List[str]):
+        self.namespaces = namespaces
+        self.bodies: Dict[str, bytes] = {}
+        self.requests = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/version", self._json({"major": "1", "minor": "30", "gitVersion": "v1.30.0"}))
+        app.router.add_get("/api", self._json({"kind": "APIVersions", "versions": ["v1"]}))
+        app.router.add_get("/apis", self._json({"kind": "APIGroupList", "apiVersion": "v1", "groups": []}))
+        app.router.add_get("/api/v1", self._json({"kind": "APIResourceList", "groupVersion": "v1", "resources": [
+            {"name": "namespaces", "singularName": "", "namespaced": False, "kind": "Namespace", "verbs": ["get", "list"]},
+            {"name": "pods", "singularName": "", "namespaced": True, "kind": "Pod", "verbs": ["get", "list"]},
+        ]}))
+        app.router.add_get("/api/v1/namespaces", self._json(self._list("NamespaceList", [
+            {"metadata": {"name": ns}} for ns in self.namespaces
+        ])))
+        app.router.add_get("/api/v1/pods", self._pods)
+        app.router.add_get("/api/v1/namespaces/{namespace}/pods", self._pods)
+        return app
+
+    @staticmethod
+    def _list(kind: str, items: List[Dict]) -> Dict:
+        return {"kind": kind, "apiVersion": "v1", "metadata": {"resourceVersion": "1"}, "items": items}
+
+    def _json(self, body: Dict):
+        body = orjson.dumps(body)
+
+        async def handler(request):
+            self.requests += 1
+            return web.Response(body=body, content_type="application/json")
+        return handler
+
+    async def _pods(self, request):
+        self.requests += 1
+        namespace = request.match_info.get("namespace")
+        if namespace not in self.bodies:
+            namespaces = [namespace] if namespace else self.namespaces
+            items = [_camel(p) for ns in namespaces for p in synthetic.inventory("pod", ns)]
+            self.bodies[namespace] = orjson.dumps(self._list("PodList", items))
+        return web.Response(body=self.bodies[namespace], content_type="application/json")
+
+
+@contextmanager
+def fake_kubernetes() -> Iterator[_FakeApiServer]:
+    # fake API server (in its own thread, so that it does not compete with the backend for event loop) with pods of
+    # synthetic namespaces, real K8S provider talks to it through "bench" context of a temporary kubeconfig
+    server = _FakeApiServer(synthetic.namespaces())
+    port = _free_port()
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def serve():
+        runner = web.AppRunner(server.app())
+        try:
+            loop.run_until_complete(runner.setup())
+            loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        finally:
+            started.set()
+        loop.run_forever()
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait()
+    previous_location = config.kube_config.KUBE_CONFIG_DEFAULT_LOCATION
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/config"
+            with open(path, "w") as f:
+                f.write(orjson.dumps({
+                    "apiVersion": "v1",
+                    "kind": "Config",
+                    "clusters": [{"name": "bench", "cluster": {"server": f"http://127.0.0.1:{port}"}}],
+                    "users": [{"name": "bench", "user": {"token": "bench"}}],
+                    "contexts": [{"name": "bench", "context": {"cluster": "bench", "user": "bench"}}],
+                    "current-context": "bench",
+                }).decode())  # JSON is valid YAML
+            config.kube_config.KUBE_CONFIG_DEFAULT_LOCATION = path
+            yield server
+    finally:
+        config.kube_config.KUBE_CONFIG_DEFAULT_LOCATION = previous_location
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
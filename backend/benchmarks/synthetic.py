@@ -0,0 +1,159 @@
+import asyncio
+from functools import lru_cache
+import os
+import random
+from typing import AsyncGenerator, Dict, List
+
+from backend.cache import cached
+from backend.model import GenericQueryException, Label, Provider
+from backend.utils import get_matches, iter_concurrently
+
+
+# inventory size - defaults are roughly a big AWS account and a big cluster
+_INSTANCES = int(os.environ.get("SWAMP_BENCH_INSTANCES", "100000"))
+_REGIONS = int(os.environ.get("SWAMP_BENCH_REGIONS", "10"))
+_NAMESPACES = int(os.environ.get("SWAMP_BENCH_NAMESPACES", "50"))
+_PODS_PER_NAMESPACE = int(os.environ.get("SWAMP_BENCH_PODS_PER_NAMESPACE", "2000"))
+# simulated upstream round-trip of a single page
+_PAGE_LATENCY = float(os.environ.get("SWAMP_BENCH_PAGE_LATENCY", "0.005"))
+_PAGE_SIZE = 1000
+
+
+class Synthetic(Provider):
+    # generated inventory with shapes of AWS instances and K8S pods, partitioned by region and namespace
+    @staticmethod
+    def provider_name() -> str:
+        return "synthetic"
+
+    @staticmethod
+    def provider_description() -> str:
+        return "Generated resources for benchmarking"
+
+    @staticmethod
+    def resources() -> List[str]:
+        return list(_resources.keys())
+
+    @staticmethod
+    def description(r: str) -> str:
+        return f"Generated {r}"
+
+    @staticmethod
+    def icon(r: str) -> str:
+        return "synthetic"
+
+    @classmethod
+    async def get(cls, r: str, labels: Dict[str, Label]) -> AsyncGenerator[Dict, None]:
+        if r not in _resources:
+            raise GenericQueryException(f"Unknown resource {r}")
+        partition_key, partitions, _ = _resources[r]
+        if partition_key not in labels:
+            raise GenericQueryException(f"You need to provide {partition_key} value to query {r}")
+        jobs = [
+            (
+                {partition_key: p},
+                lambda p=p: cached((cls.provider_name(), r, p), lambda: cls._fetch(r, p))
+            )
+            for p in get_matches(labels[partition_key], partitions())
+        ]
+        async for x in iter_concurrently(jobs, limit=16):
+            yield x
+
+    @classmethod
+    async def _fetch(cls, r: str, partition: str) -> AsyncGenerator[Dict, None]:
+        items = inventory(r, partition)
+        for start in range(0, len(items), _PAGE_SIZE):
+            await asyncio.sleep(_PAGE_LATENCY)
+            for item in items[start:start + _PAGE_SIZE]:
+                yield item
+
+
+def regions() -> List[str]:
+    return [f"region-{i}" for i in range(_REGIONS)]
+
+
+def namespaces() -> List[str]:
+    return [f"namespace-{i}" for i in range(_NAMESPACES)]
+
+
+@lru_cache(maxsize=None)
+def inventory(r: str, partition: str) -> List[Dict]:
+    # generated once per partition and seeded by it, so that every run (and commit) sees the same data
+    _, partitions, generate = _resources[r]
+    rnd = random.Random(f"{r}:{partition}")
+    count = _INSTANCES // _REGIONS if r == "instance" else _PODS_PER_NAMESPACE
+    index = partitions().index(partition)
+    return [generate(rnd, partition, index * count + i) for i in range(count)]
+
+
+def _instance(rnd: random.Random, region: str, i: int) -> Dict:
+    vpc, subnet = f"vpc-{i % 20:08x}", f"subnet-{i % 200:08x}"
+    return {
+        "_id": f"i-{i:017x}",
+        "_synthetic_region": region,
+        "InstanceId": f"i-{i:017x}",
+        "ImageId": f"ami-{rnd.randrange(50):08x}",
+        "InstanceType": rnd.choice(["t3.micro", "t3.large", "m5.xlarge", "c5.2xlarge", "r6g.large"]),
+        "LaunchTime": f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T12:00:00+00:00",
+        "State": {"Code": 16, "Name": rnd.choice(["running"] * 8 + ["stopped", "terminated"])},
+        "PrivateIpAddress": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+        "SubnetId": subnet,
+        "VpcId": vpc,
+        "Placement": {"AvailabilityZone": f"{region}{rnd.choice('abc')}", "Tenancy": "default"},
+        "BlockDeviceMappings": [
+            {"DeviceName": f"/dev/xvd{d}", "Ebs": {"VolumeId": f"vol-{i:09x}{d}", "Status": "attached", "DeleteOnTermination": True}}
+            for d in "ab"[:rnd.randint(1, 2)]
+        ],
+        "NetworkInterfaces": [{
+            "NetworkInterfaceId": f"eni-{i:017x}",
+            "SubnetId": subnet,
+            "VpcId": vpc,
+            "Groups": [{"GroupId": f"sg-{rnd.randrange(100):08x}", "GroupName": "default"}],
+            "PrivateIpAddresses": [{"Primary": True, "PrivateIpAddress": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"}],
+        }],
+        "Tags": [
+            {"Key": "Name", "Value": f"host-{i}"},
+            {"Key": "team", "Value": rnd.choice(["payments", "search", "platform", "data"])},
+            {"Key": "env", "Value": rnd.choice(["prod", "staging", "dev"])},
+        ],
+    }
+
+
+def _pod(rnd: random.Random, namespace: str, i: int) -> Dict:
+    app = rnd.choice(["api", "worker", "web", "cron", "db"])
+    return {
+        "_id": f"{app}-{i:x}",
+        "_synthetic_namespace": namespace,
+        "api_version": "v1",
+        "kind": "Pod",
+        "metadata": {
+            "name": f"{app}-{i:x}",
+            "namespace": namespace,
+            "uid": f"{i:08x}-0000-4000-8000-{rnd.getrandbits(48):012x}",
+            "labels": {"app": app, "tier": rnd.choice(["frontend", "backend"]), "pod-template-hash": f"{rnd.getrandbits(32):x}"},
+            "owner_references": [{"kind": "ReplicaSet", "name": f"{app}-{rnd.getrandbits(32):x}", "controller": True}],
+        },
+        "spec": {
+            "node_name": f"node-{rnd.randrange(100)}",
+            "service_account_name": "default",
+            "containers": [
+                {
+                    "name": app,
+                    "image": f"registry.local/{app}:{rnd.randint(1, 40)}",
+                    "ports": [{"container_port": 8080, "protocol": "TCP"}],
+                    "resources": {"requests": {"cpu": "100m", "memory": "128Mi"}, "limits": {"memory": "256Mi"}},
+                    "env": [{"name": f"VAR_{e}", "value": str(rnd.random())} for e in range(rnd.randint(0, 5))],
+                }
+            ],
+        },
+        "status": {
+            "phase": rnd.choice(["Running"] * 9 + ["Pending"]),
+            "pod_ip": f"172.16.{i >> 8 & 255}.{i & 255}",
+            "conditions": [{"type": t, "status": "True"} for t in ["Initialized", "Ready", "ContainersReady", "PodScheduled"]],
+        },
+    }
+
+
+_resources = {
+    "instance": ("_synthetic_region", regions, _instance),
+    "pod": ("_synthetic_namespace", namespaces, _pod),
+}
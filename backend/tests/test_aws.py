@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import json
+import pytest
+
+import botocore.session
+from botocore import xform_name
+
+from backend.model import Label
+from backend.modules import aws
+
+
+class _FakeClient:
+    def __init__(self, key):
+        self.key = key
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.closed = True
+
+
+class _FakeSession:
+    created = []
+
+    def __init__(self, profile_name):
+        self.profile_name = profile_name
+
+    def client(self, service, region_name, config=None):
+        client = _FakeClient((self.profile_name, region_name, service))
+        _FakeSession.created.append(client)
+        return client
+
+
+def test_client_pool_reuses_and_evicts_clients(monkeypatch):
+    monkeypatch.setattr(aws.aioboto3, "Session", _FakeSession)
+    _FakeSession.created = []
+    pool = aws._ClientPool(max_size=2, idle_timeout=60)
+
+    async def use(*key):
+        async with pool.client(*key) as client:
+            return client
+
+    async def run():
+        first = await use("p", "eu-west-1", "ec2")
+        assert await use("p", "eu-west-1", "ec2") is first
+        await use("p", "us-east-1", "ec2")
+        await use("p", "us-east-1", "elbv2")
+        # pool holds 2 clients, so the least recently used one got closed
+        assert first.closed
+        await pool.close()
+
+    asyncio.run(run())
+    assert len(_FakeSession.created) == 3
+    assert all(c.closed for c in _FakeSession.created)
+
+
+@pytest.mark.parametrize("r,labels,params", [
+    ("instance", [Label(key=".VpcId", op="==", val="vpc-1")], {"Filters": [{"Name": "vpc-id", "Values": ["vpc-1"]}]}),
+    ("instance", [Label(key="State.Name", op="==", val="running"), Label(key=".SubnetId", op="like", val="subnet-.*")],
+     {"Filters": [{"Name": "instance-state-name", "Values": ["running"]}]}),
+    ("instance", [Label(key='.Tags[] | select(.Key == "Name") | .Value', op="==", val="web")], {"Filters": [{"Name": "tag:Name", "Values": ["web"]}]}),
+    ("subnet", [Label(key=".Tags[].Key", op="contains", val="team")], {"Filters": [{"Name": "tag-key", "Values": ["team"]}]}),
+    ("nat_gateway", [Label(key=".VpcId", op="==", val="vpc-1")], {"Filter": [{"Name": "vpc-id", "Values": ["vpc-1"]}]}),
+    ("autoscaling_group", [Label(key=".AutoScalingGroupName", op="==", val="asg")], {"AutoScalingGroupNames": ["asg"]}),
+    ("vpc", [Label(key=".VpcId", op="!=", val="vpc-1"), Label(key="_aws_region", op="==", val="eu-west-1")], {}),
+    ("dx_connection", [Label(key=".connectionId", op="==", val="dx-1")], {}),
+    ("subnet", [Label(key=".VpcId", op="in", val='["vpc-1", "vpc-2"]')], {"Filters": [{"Name": "vpc-id", "Values": ["vpc-1", "vpc-2"]}]}),
+    ("autoscaling_group", [Label(key=".AutoScalingGroupName", op="in", val="[]")], {}),
+])
+def test_api_params_pushes_down_supported_labels(r, labels, params):
+    assert aws._api_params(r, {l.key: l for l in labels}) == params
+
+
+def test_normalize_matches_json_round_trip():
+    item = {
+        "LaunchTime": datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc),
+        "UserData": b"blob",
+        "Tags": [{"Key": "a", "Value": "b"}],
+        "BlockDeviceMappings": [{"Ebs": {"AttachTime": datetime.datetime(2024, 5, 1), "DeleteOnTermination": True}}],
+        "CpuOptions": {"CoreCount": 2, "ThreadsPerCore": 1.5},
+        "Nothing": None,
+    }
+    expected = json.loads(json.dumps(item, default=str))
+    assert aws._normalize(item) == expected
+
+
+class _Shape:
+    def __init__(self, type_name, name, **kwargs):
+        self.type_name = type_name
+        self.name = name
+        self.__dict__.update(kwargs)
+
+
+def test_example_cuts_recursive_structures(monkeypatch):
+    monkeypatch.setattr(aws, "_EXAMPLE_MAX_DEPTH", 3)
+    node = _Shape("structure", "Node", members={"Name": _Shape("string", "String")})
+    node.members["Children"] = _Shape("list", "NodeList", member=node)
+    example = aws.AWS._example_rec(node, "aws.node", 0, {}, set())
+    assert example == {"Name": "Name_VALUE", "Children": [None, None]}
+
+
+def test_example_does_not_share_structures_cut_inside_a_cycle(monkeypatch):
+    monkeypatch.setattr(aws, "_EXAMPLE_MAX_DEPTH", 10)
+    a, b = _Shape("structure", "A", members={}), _Shape("structure", "B", members={})
+    a.members["B"], b.members["A"] = b, a
+    root = _Shape("structure", "Root", members={"X": a, "Y": _Shape("structure", "Wrapper", members={"B": b})})
+    # B is first reached inside A, where A is cut - reached through Wrapper it has A expanded
+    example = aws.AWS._example_rec(root, "aws.root", 0, {}, set())
+    assert example == {"X": {"B": {"A": None}}, "Y": {"B": {"A": {"B": None}}}}
+
+
+def test_page_size_is_within_limits_of_every_api():
+    session = botocore.session.get_session()
+    for r, resource in aws._resources.items():
+        model = session.get_service_model(resource["client"])
+        operation = {xform_name(o): o for o in model.operation_names}[resource["operation"]]
+        try:
+            limit_key = session.get_paginator_model(resource["client"]).get_paginator(operation).get("limit_key")
+        except ValueError:
+            continue  # not paginated
+        limits = model.operation_model(operation).input_shape.members[limit_key].metadata
+        assert limits.get("min", 1) <= aws._page_size(r) <= limits.get("max", aws._PAGE_SIZE), r
+
+
+class _Paginator:
+    def __init__(self, pages):
+        self.pages = pages
+        self.config = None
+        self.closed = False
+
+    def paginate(self, PaginationConfig, **params):
+        self.config = PaginationConfig
+
+        async def pages():
+            try:
+                for page in self.pages:
+                    yield page
+            finally:
+                self.closed = True
+
+        return pages()
+
+
+@pytest.mark.parametrize("max_items,ids", [(0, ["vpc-0", "vpc-1", "vpc-2", "vpc-3", "vpc-4"]), (3, ["vpc-0", "vpc-1", "vpc-2"])])
+def test_fetch_follows_all_pages_up_to_max_items(monkeypatch, max_items, ids):
+    paginator = _Paginator([{"Vpcs": [{"VpcId": f"vpc-{i}"} for i in range(j, min(j + 2, 5))]} for j in range(0, 5, 2)])
+    client = type("Client", (), {"can_paginate": lambda self, op: True, "get_paginator": lambda self, op: paginator})()
+
+    class _Pool:
+        @aws.asynccontextmanager
+        async def client(self, profile, region, service):
+            yield client
+
+    monkeypatch.setattr(aws, "_CLIENT_POOL", _Pool())
+    monkeypatch.setattr(aws, "_MAX_ITEMS", max_items)
+
+    async def run():
+        return [x async for x in aws.AWS._fetch("ec2", "vpc", "p", "eu-west-1", {})]
+
+    assert [x["_id"] for x in asyncio.run(run())] == ids
+    assert paginator.config == {"PageSize": 1000}
+    assert paginator.closed
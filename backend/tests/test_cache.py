@@ -0,0 +1,149 @@
+import asyncio
+import pytest
+
+from backend import cache, snapshot
+from backend.cache import ResultCache, cache_control
+from backend.snapshot import SnapshotStore
+
+
+class _Upstream:
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+
+    def factory(self, key):
+        async def gen():
+            self.calls += 1
+            await asyncio.sleep(0.01)
+            if self.fail:
+                raise RuntimeError("boom")
+            yield {"key": key, "call": self.calls}
+        return gen
+
+
+async def _collect(cache, key, upstream):
+    return [x async for x in cache.get(key, upstream.factory(key))]
+
+
+def test_cache_serves_repeated_requests_from_memory():
+    cache, upstream = ResultCache(ttl=60, max_entries=10), _Upstream()
+
+    async def run():
+        first = await _collect(cache, "a", upstream)
+        second = await _collect(cache, "a", upstream)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == [{"key": "a", "call": 1}]
+    assert upstream.calls == 1
+
+
+def test_cache_coalesces_concurrent_requests():
+    cache, upstream = ResultCache(ttl=0, max_entries=10), _Upstream()
+
+    async def run():
+        return await asyncio.gather(*(_collect(cache, "a", upstream) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert all(r == [{"key": "a", "call": 1}] for r in results)
+    assert upstream.calls == 1
+
+
+def test_cache_refresh_and_eviction():
+    cache, upstream = ResultCache(ttl=60, max_entries=1), _Upstream()
+
+    async def run():
+        await _collect(cache, "a", upstream)
+        with cache_control("no-cache"):
+            assert await _collect(cache, "a", upstream) == [{"key": "a", "call": 2}]
+        await _collect(cache, "b", upstream)
+        # "a" got evicted by "b"
+        assert await _collect(cache, "a", upstream) == [{"key": "a", "call": 4}]
+
+    asyncio.run(run())
+
+
+def test_cache_does_not_store_errors():
+    cache, upstream = ResultCache(ttl=60, max_entries=10), _Upstream(fail=True)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await _collect(cache, "a", upstream)
+
+    asyncio.run(run())
+    assert upstream.calls == 2
+
+
+def test_snapshot_is_served_while_refreshing(tmp_path):
+    store, upstream = SnapshotStore(str(tmp_path / "snapshots.db"), max_age=3600), _Upstream()
+    key = ("fake", "thing", None)
+
+    async def run():
+        await _collect(ResultCache(ttl=0.2, max_entries=10, store=store), key, upstream)
+        await asyncio.sleep(0.3)
+        # e.g. after a restart - nothing in memory, but the last (already expired) snapshot can be served immediately
+        cache = ResultCache(ttl=0.2, max_entries=10, store=store)
+        with cache_control("max-stale"):
+            stale = await _collect(cache, key, upstream)
+        await asyncio.sleep(0.1)
+        return stale, await _collect(cache, key, upstream)
+
+    stale, fresh = asyncio.run(run())
+    assert stale == [{"key": list(key), "call": 1}]
+    assert fresh == [{"key": key, "call": 2}]
+
+
+def test_fresh_snapshot_is_served_without_fetching(tmp_path):
+    store, upstream = SnapshotStore(str(tmp_path / "snapshots.db"), max_age=3600), _Upstream()
+
+    async def run():
+        await _collect(ResultCache(ttl=60, max_entries=10, store=store), "a", upstream)
+        await asyncio.sleep(0.1)
+        return await _collect(ResultCache(ttl=60, max_entries=10, store=store), "a", upstream)
+
+    assert asyncio.run(run()) == [{"key": "a", "call": 1}]
+    assert upstream.calls == 1
+
+
+def test_workers_sharing_a_store_fetch_a_partition_once(tmp_path):
+    store, upstream = SnapshotStore(str(tmp_path / "snapshots.db"), max_age=3600), _Upstream()
+    # every cache stands for a worker process
+    workers = [ResultCache(ttl=60, max_entries=10, store=store, shared=True) for _ in range(3)]
+
+    async def run():
+        with cache_control("no-cache"):
+            return await asyncio.gather(*(_collect(w, "a", upstream) for w in workers))
+
+    results = asyncio.run(run())
+    assert upstream.calls == 1
+    assert results[0] == [{"key": "a", "call": 1}]
+    assert results[1:] == [[{"key": "a", "call": 1}]] * 2
+
+
+def test_waiting_workers_read_items_only_once_they_are_fetched(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_LEASE_POLL_INTERVAL", 0.001)
+    store, upstream = SnapshotStore(str(tmp_path / "snapshots.db"), max_age=3600), _Upstream()
+    workers = [ResultCache(ttl=60, max_entries=10, store=store, shared=True) for _ in range(2)]
+    load, loaded = store.load, []
+
+    async def counted_load(key):
+        loaded.append(key)
+        return await load(key)
+
+    monkeypatch.setattr(store, "load", counted_load)
+
+    async def run():
+        with cache_control("no-cache"):
+            return await asyncio.gather(*(_collect(w, "a", upstream) for w in workers))
+
+    assert asyncio.run(run()) == [[{"key": "a", "call": 1}]] * 2
+    assert loaded == ["a"]
+
+
+def test_store_is_readable_only_by_its_owner(tmp_path):
+    path = tmp_path / "cache" / "snapshots.sqlite"
+    snapshot._create_private(str(path))
+    SnapshotStore(str(path), max_age=3600)
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert path.parent.stat().st_mode & 0o777 == 0o700
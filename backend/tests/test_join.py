@@ -0,0 +1,36 @@
+import pytest
+
+from backend.join import join
+from backend.model import GenericQueryException, Link
+
+
+vpcs = [{"VpcId": "vpc-1"}, {"VpcId": "vpc-2"}, {"Name": "no id"}]
+subnets = [
+    {"SubnetId": "s-1", "VpcId": "vpc-1"},
+    {"SubnetId": "s-2", "VpcId": "vpc-2"},
+    {"SubnetId": "s-3", "VpcId": "vpc-1"},
+    {"SubnetId": "s-4"},
+]
+acls = [
+    {"Associations": [{"SubnetId": "s-1"}, {"SubnetId": "s-2"}]},
+    {"Associations": [{"SubnetId": "s-3"}]},
+    {"Associations": "not a list"},
+]
+
+
+@pytest.mark.parametrize("left,right,link,edges", [
+    (vpcs, subnets, Link(fromAttr=".VpcId", op="=", toAttr=".VpcId"), [(0, 0), (0, 2), (1, 1)]),
+    (vpcs, subnets, Link(fromAttr="VpcId", op="==", toAttr="VpcId"), [(0, 0), (0, 2), (1, 1)]),
+    (vpcs[:2], subnets, Link(fromAttr=".VpcId", op="!=", toAttr=".VpcId"), [(0, 1), (1, 0), (1, 2)]),
+    (subnets, acls, Link(fromAttr=".SubnetId", op="contains", toAttr=".Associations[].SubnetId"), [(0, 0), (1, 0), (2, 1)]),
+    (acls, subnets, Link(fromAttr=".Associations[].SubnetId", op="contains", toAttr=".SubnetId"), [(0, 0), (0, 1), (1, 2)]),
+    (subnets[:2], acls, Link(fromAttr=".SubnetId", op="not contains", toAttr=".Associations[].SubnetId"), [(0, 1), (1, 1)]),
+    (subnets, [{"Prefix": "s-"}], Link(fromAttr=".SubnetId", op="like", toAttr=".Prefix"), [(0, 0), (1, 0), (2, 0), (3, 0)]),
+])
+def test_join(left, right, link, edges):
+    assert join(left, right, link) == edges
+
+
+def test_join_rejects_unknown_operator():
+    with pytest.raises(GenericQueryException):
+        join(vpcs, subnets, Link(fromAttr=".VpcId", op="~", toAttr=".VpcId"))
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import pytest
+
+from backend.model import Label
+from backend.modules import k8s
+
+
+class _FakeApi:
+    def __init__(self, context):
+        self.context = context
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class _FakeDynamicClient:
+    def __init__(self, api):
+        self.client = api
+        self.discoveries = 0
+        self.resources = self
+
+    async def get(self, api_version, kind):
+        self.discoveries += 1
+        return (api_version, kind)
+
+    def __await__(self):
+        yield from []
+        return self
+
+
+class _Pooled:
+    # pooled client that returns the given resource handle, and talks to API server through the given api
+    def __init__(self, resource=None, api=None):
+        self._resource = resource
+        self.client = type("DynamicClient", (), {"client": api})
+        self.openapi_paths = None
+        self.server_version = None
+
+    async def resource(self, api_version, kind):
+        return self._resource
+
+
+class _Pool:
+    def __init__(self, pooled):
+        self.pooled = pooled
+
+    @k8s.asynccontextmanager
+    async def client(self, context):
+        yield self.pooled
+
+
+def _use_pool(monkeypatch, resource=None, api=None):
+    monkeypatch.setattr(k8s, "_CLIENT_POOL", _Pool(_Pooled(resource, api)))
+
+
+def test_client_pool_reuses_clients_until_kubeconfig_changes(monkeypatch):
+    created = []
+
+    async def new_client_from_config(context=None):
+        created.append(_FakeApi(context))
+        return created[-1]
+
+    mtimes = [(1.0,)]
+    monkeypatch.setattr(k8s.config, "new_client_from_config", new_client_from_config)
+    monkeypatch.setattr(k8s, "DynamicClient", _FakeDynamicClient)
+    monkeypatch.setattr(k8s, "_kubeconfig_mtimes", lambda: mtimes[0])
+    pool = k8s._ClientPool(max_age=600)
+
+    async def resource(context):
+        async with pool.client(context) as pooled:
+            return pooled.client, await pooled.resource("v1", "Pod")
+
+    async def run():
+        first, res = await resource("a")
+        again, _ = await resource("a")
+        assert again is first and res == ("v1", "Pod")
+        assert first.discoveries == 1
+        mtimes[0] = (2.0,)
+        fresh, _ = await resource("a")
+        assert fresh is not first and first.client.closed
+        await pool.close()
+
+    asyncio.run(run())
+    assert len(created) == 2 and all(api.closed for api in created)
+
+
+@pytest.mark.parametrize("r,labels,selectors", [
+    ("pod", [Label(key=".metadata.labels.app", op="==", val="web")], {"label_selector": "app=web"}),
+    ("pod", [Label(key='.metadata.labels["app.kubernetes.io/name"]', op="!=", val="db")], {"label_selector": "app.kubernetes.io/name!=db"}),
+    ("pod", [Label(key=".spec.nodeName", op="==", val="node-1"), Label(key=".status.phase", op="!=", val="Running")],
+     {"field_selector": "spec.nodeName=node-1,status.phase!=Running"}),
+    ("deployment", [Label(key="_id", op="==", val="api"), Label(key=".spec.replicas", op="==", val="3")], {"field_selector": "metadata.name=api"}),
+    ("pod", [Label(key=".metadata.labels.app", op="like", val="we.*"), Label(key=".metadata.labels.app", op="==", val="not valid!")], {}),
+    ("pod", [Label(key="_k8s_context", op="==", val="prod"), Label(key=".metadata.ownerReferences[].name", op="contains", val="rs")], {}),
+    ("pod", [Label(key=".metadata.labels.app", op="in", val='["web", "api"]'), Label(key=".metadata.name", op="in", val='["a"]')],
+     {"label_selector": "app in (web,api)"}),
+    ("pod", [Label(key=".metadata.labels.app", op="in", val="[]")], {}),
+])
+def test_selectors_push_down_supported_labels(r, labels, selectors):
+    assert k8s._selectors(r, {f"{l.key}{i}": l for i, l in enumerate(labels)}) == selectors
+
+
+def test_namespaces_are_listed_once_per_context(monkeypatch):
+    listed = []
+
+    class _Namespaces:
+        async def get(self):
+            listed.append(True)
+            return type("List", (), {"items": [type("Ns", (), {"metadata": type("Meta", (), {"name": n})}) for n in ("a", "b")]})
+
+    _use_pool(monkeypatch, resource=_Namespaces())
+    monkeypatch.setattr(k8s, "_CONTEXT_TO_NAMESPACES", {})
+
+    async def run():
+        return await k8s._get_namespaces_of_contexts(["x", "y"]), await k8s._get_namespaces("x")
+
+    assert asyncio.run(run()) == ({"x": ["a", "b"], "y": ["a", "b"]}, ["a", "b"])
+    assert len(listed) == 2
+
+
+def _pod(name, version):
+    return {"metadata": {"name": name, "namespace": "default", "uid": name, "resourceVersion": version}}
+
+
+class _Item:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def to_dict(self):
+        return self.raw
+
+
+def test_informer_keeps_items_up_to_date_with_watch(monkeypatch):
+    go = asyncio.Event()
+    watches = []
+
+    class _Pods:
+        async def get(self, namespace=None):
+            listed = [_pod("a", "1"), _pod("b", "1")] if not watches else [_pod("a", "5"), _pod("c", "5")]
+            return type("List", (), {"metadata": type("Meta", (), {"resourceVersion": "1"}), "items": [_Item(p) for p in listed]})
+
+        async def watch(self, namespace=None, resource_version=None, timeout=None):
+            watches.append(resource_version)
+            if len(watches) == 1:
+                await go.wait()
+                yield {"type": "MODIFIED", "raw_object": _pod("a", "2")}
+                yield {"type": "DELETED", "raw_object": _pod("b", "3")}
+                raise k8s.ApiException(status=410)
+            await asyncio.Event().wait()
+
+    _use_pool(monkeypatch, resource=_Pods())
+    informers = k8s._Informers()
+
+    async def run():
+        informer = await informers.get("pod", "ctx", "default")
+        events, seen = informer.events(), []
+        while not seen or seen[-1]["type"] != "synced":
+            seen.append(await anext(events))
+        go.set()
+        # after watch events, 410 makes it list everything again - and only the difference gets published
+        for _ in range(4):
+            seen.append(await anext(events))
+        items = sorted((x["_id"], x["metadata"]["resourceVersion"]) for x in informer.items.values())
+        informers.reset()
+        return [(e["type"], e.get("result", {}).get("_id")) for e in seen], items
+
+    seen, items = asyncio.run(run())
+    assert seen == [
+        ("added", "a"), ("added", "b"), ("synced", None),
+        ("modified", "a"), ("deleted", "b"), ("modified", "a"), ("added", "c"),
+    ]
+    assert items == [("a", "5"), ("c", "5")]
+    assert watches == ["1", "1"]
+
+
+class _Response:
+    def __init__(self, status, body=None):
+        self.status = status
+        self.reason = "reason"
+        self.body = body
+
+    async def read(self):
+        return json.dumps(self.body).encode()
+
+    def release(self):
+        pass
+
+
+_POD_SCHEMA = {
+    "io.k8s.api.core.v1.Pod": {"properties": {"kind": {"type": "string"}, "spec": {"allOf": [{"$ref": "#/components/schemas/io.k8s.api.core.v1.PodSpec"}]}}},
+    "io.k8s.api.core.v1.PodSpec": {"properties": {"nodeName": {"type": "string"}}},
+}
+
+
+_DEPLOYMENT_SCHEMA = {"io.k8s.api.apps.v1.Deployment": {"properties": {"spec": {"type": "object"}}}}
+_V3_PATHS = {
+    "api/v1": {"serverRelativeURL": "/openapi/v3/api/v1?hash=abc"},
+    "apis/apps/v1": {"serverRelativeURL": "/openapi/v3/apis/apps/v1?hash=def"},
+}
+
+
+@pytest.mark.parametrize("r,documents,example", [
+    (
+        "pod",
+        {
+            "/openapi/v3": {"paths": _V3_PATHS},
+            "/openapi/v3/api/v1?hash=abc": {"components": {"schemas": _POD_SCHEMA}},
+        },
+        {"spec": {"nodeName": "nodeName_VALUE"}},
+    ),
+    (
+        "pod",
+        {
+            "/version": {"gitVersion": "v1.23.0"},
+            "/openapi/v2": {"definitions": {"io.k8s.api.core.v1.Pod": {"properties": {"spec": {"type": "string"}}}}},
+        },
+        {"spec": "spec_VALUE"},
+    ),
+    (
+        "deployment",
+        {
+            "/openapi/v3": {"paths": _V3_PATHS},
+            "/openapi/v3/apis/apps/v1?hash=def": {"components": {"schemas": _DEPLOYMENT_SCHEMA}},
+        },
+        {"spec": "spec_VALUE"},
+    ),
+    (
+        # definition is not in the document of declared api group
+        "deployment",
+        {
+            "/openapi/v3": {"paths": {"apis/apps/v1": {"serverRelativeURL": "/openapi/v3/apis/apps/v1?hash=def"}}},
+            "/openapi/v3/apis/apps/v1?hash=def": {"components": {"schemas": {}}},
+            "/version": {"gitVersion": "v1.23.0"},
+            "/openapi/v2": {"definitions": _DEPLOYMENT_SCHEMA},
+        },
+        {"spec": "spec_VALUE"},
+    ),
+])
+def test_openapi_schema_is_fetched_per_api_group_and_cached(monkeypatch, r, documents, example):
+    requested = []
+
+    class _Api:
+        async def call_api(self, path, method, **kwargs):
+            requested.append(path)
+            return _Response(200, documents[path]) if path in documents else _Response(404)
+
+    _use_pool(monkeypatch, api=_Api())
+    monkeypatch.setattr(k8s, "_SCHEMAS", {})
+
+    async def run():
+        return [await k8s._generate_example_from_openapi_schema(
+            k8s._resources[r]["api_version"], k8s._resources[r]["openapi_path"]
+        ) for _ in range(2)]
+
+    assert asyncio.run(run()) == [example, example]
+    assert sorted(set(requested)) == sorted(set(documents) | {"/openapi/v3"})
+    assert all(requested.count(path) == 1 for path in requested)
+
+
+def test_example_generator_cuts_recursive_definitions_and_shares_repeated_ones(monkeypatch):
+    monkeypatch.setattr(k8s, "_EXAMPLE_MAX_DEPTH", 3)
+    generator = k8s._ExampleGenerator({
+        "Props": {"properties": {
+            "type": {"type": "string"},
+            "items": {"$ref": "#/definitions/Props"},
+            "nested": {"$ref": "#/definitions/Leaf"},
+            "more": {"type": "array", "items": {"$ref": "#/definitions/Leaf"}},
+        }},
+        "Leaf": {"properties": {"deep": {"$ref": "#/definitions/Deeper"}}},
+        "Deeper": {"properties": {"deepest": {"$ref": "#/definitions/Leaf"}}},
+    })
+    example = generator.example("Props")
+    assert example["items"] == "items_VALUE"
+    assert example["nested"] == {"deep": {"deepest": "deepest_VALUE"}}
+    assert example["more"][0] is example["more"][1] is example["nested"]
+    assert generator.example("Props") is example
+
+
+def test_example_generator_does_not_share_definitions_cut_inside_a_cycle():
+    generator = k8s._ExampleGenerator({
+        "Root": {"properties": {"x": {"$ref": "#/definitions/A"}, "y": {"$ref": "#/definitions/Wrapper"}}},
+        "Wrapper": {"properties": {"b": {"$ref": "#/definitions/B"}}},
+        "A": {"properties": {"b": {"$ref": "#/definitions/B"}}},
+        "B": {"properties": {"a": {"$ref": "#/definitions/A"}}},
+    })
+    # B is first reached inside A, where A is cut - reached through Wrapper it has A expanded
+    assert generator.example("Root") == {"x": {"b": {"a": "a_VALUE"}}, "y": {"b": {"a": {"b": "b_VALUE"}}}}
@@ -0,0 +1,136 @@
+import asyncio
+from fastapi import HTTPException, Request
+import pytest
+from typing import Dict, List
+
+from backend.cache import cached
+from backend.main import JoinRequest, VertexQuery, do_partial_get, get, iter_batch_events, iter_get_events, join_results, metadata_response, stream_events
+from backend.model import GenericQueryException, Label, Provider
+from backend.utils import get_matches, iter_concurrently
+
+
+class FakeProvider(Provider):
+    upstream_calls = []
+
+    @staticmethod
+    def provider_name() -> str:
+        return "fake"
+
+    @staticmethod
+    def resources() -> List[str]:
+        return ["thing"]
+
+    @classmethod
+    async def get(cls, r: str, labels: Dict[str, Label]):
+        if "_fake_region" not in labels:
+            raise GenericQueryException("You need to provide _fake_region")
+
+        def partition(region):
+            async def gen():
+                cls.upstream_calls.append(region)
+                await asyncio.sleep(0.01)
+                if region == "broken":
+                    raise RuntimeError("region is broken")
+                for i in range(3):
+                    yield {"_id": f"{region}-{i}", "_fake_region": region, "index": str(i)}
+            return gen
+
+        regions = get_matches(labels["_fake_region"], ["a", "b", "broken"])
+        jobs = [
+            ({"_fake_region": region}, lambda region=region: cached(("fake", r, region), partition(region)))
+            for region in regions
+        ]
+        async for x in iter_concurrently(jobs, limit=2):
+            yield x
+
+
+def _events(labels):
+    async def run():
+        return [e async for e in iter_get_events("fake", "thing", labels)]
+    return asyncio.run(run())
+
+
+def test_iter_get_events_streams_filtered_results_and_partition_progress():
+    events = _events({
+        "_fake_region": Label(key="_fake_region", op="like", val=".*"),
+        "index": Label(key="index", op="==", val="1"),
+    })
+    results = sorted(e["result"]["_id"] for e in events if e["type"] == "result")
+    assert results == ["a-1", "b-1"]
+    errors = [e for e in events if e["type"] == "partition" and e["status"] == "error"]
+    assert errors == [{"type": "partition", "status": "error", "partition": {"_fake_region": "broken"}, "count": 0, "detail": "region is broken"}]
+    assert events[-1] == {"type": "done", "count": 2}
+
+
+def test_iter_get_events_raises_for_invalid_query():
+    with pytest.raises(GenericQueryException):
+        _events({})
+
+
+def test_do_partial_get_reports_failed_partitions_next_to_results():
+    results, errors = asyncio.run(do_partial_get("fake", "thing", {"_fake_region": Label(key="_fake_region", op="like", val=".*")}))
+    assert sorted(r["_id"] for r in results) == ["a-0", "a-1", "a-2", "b-0", "b-1", "b-2"]
+    assert errors == [{"partition": {"_fake_region": "broken"}, "detail": "region is broken"}]
+    with pytest.raises(RuntimeError):
+        asyncio.run(do_partial_get("fake", "thing", {"_fake_region": Label(key="_fake_region", op="==", val="broken")}))
+
+
+def test_invalid_stream_format_is_bad_request():
+    request = Request({"type": "http", "headers": [], "query_string": b"_provider=fake&_resource=thing&_stream=bogus"})
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(get(request))
+    assert e.value.status_code == 400
+
+
+def test_failing_join_side_is_server_error():
+    broken = [Label(key="_fake_region", op="==", val="broken")]
+    request = JoinRequest.model_validate({
+        "link": {"fromAttr": "._id", "toAttr": "._id"},
+        "from": {"query": {"id": "v1", "provider": "fake", "resource": "thing", "labels": broken}},
+        "to": {"results": []},
+    })
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(join_results(Request({"type": "http", "headers": []}), request))
+    assert (e.value.status_code, e.value.detail) == (500, "region is broken")
+
+
+def test_stream_of_no_events_is_empty():
+    async def no_events():
+        return
+        yield
+
+    async def run():
+        response = await stream_events(no_events(), "ndjson")
+        return [chunk async for chunk in response.body_iterator]
+
+    assert asyncio.run(run()) == []
+
+
+def test_iter_batch_events_tags_events_with_vertex_and_fetches_shared_partitions_once():
+    region = Label(key="_fake_region", op="like", val="(a|b)$")
+    queries = [
+        VertexQuery(id="v1", provider="fake", resource="thing", labels=[region, Label(key="index", op="==", val="0")]),
+        VertexQuery(id="v2", provider="fake", resource="thing", labels=[region]),
+        VertexQuery(id="v3", provider="fake", resource="thing", labels=[]),
+    ]
+    FakeProvider.upstream_calls = []
+
+    async def run():
+        return [e async for e in iter_batch_events(queries, "no-cache")]
+
+    events = asyncio.run(run())
+    results = {v: sorted(e["result"]["_id"] for e in events if e["vertex"] == v and e["type"] == "result") for v in ("v1", "v2")}
+    assert results == {"v1": ["a-0", "b-0"], "v2": ["a-0", "a-1", "a-2", "b-0", "b-1", "b-2"]}
+    assert sorted(FakeProvider.upstream_calls) == ["a", "b"]
+    assert [e["type"] for e in events if e["vertex"] == "v3"] == ["error"]
+
+
+def test_metadata_response_is_not_sent_again_when_etag_matches():
+    def request(*headers):
+        return Request({"type": "http", "headers": [(k.encode(), v.encode()) for k, v in headers]})
+
+    first = metadata_response(request(), b'{"a": 1}')
+    assert first.status_code == 200 and first.body == b'{"a": 1}'
+    etag = first.headers["etag"]
+    assert metadata_response(request(("if-none-match", f'"other", {etag}')), b'{"a": 1}').status_code == 304
+    assert metadata_response(request(("if-none-match", etag)), b'{"a": 2}').status_code == 200
@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+
+from backend import metrics
+from backend.cache import ResultCache
+from backend.model import Label, filter_records
+
+
+def _samples(name):
+    return [l for l in metrics.render().decode().splitlines() if l.startswith(name)]
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("swamp_test_seconds", "Test", ["what"], buckets=(0.1, 1.0))
+    for value in [0.05, 0.5, 0.5, 3]:
+        histogram.observe(value, what='a "b"')
+    assert _samples("swamp_test_seconds") == [
+        'swamp_test_seconds_bucket{what="a \\"b\\"",le="0.1"} 1',
+        'swamp_test_seconds_bucket{what="a \\"b\\"",le="1"} 3',
+        'swamp_test_seconds_bucket{what="a \\"b\\"",le="+Inf"} 4',
+        'swamp_test_seconds_sum{what="a \\"b\\""} 4.05',
+        'swamp_test_seconds_count{what="a \\"b\\""} 4',
+    ]
+
+
+def test_upstream_call_counts_errors_and_in_flight_calls():
+    labels = {"provider": "test", "service": "thing", "location": "here"}
+    with metrics.upstream_call(**labels):
+        assert metrics.UPSTREAM_IN_FLIGHT.value(provider="test") == 1
+    with pytest.raises(RuntimeError):
+        with metrics.upstream_call(**labels):
+            raise RuntimeError("throttled")
+    assert metrics.UPSTREAM_IN_FLIGHT.value(provider="test") == 0
+    assert metrics.UPSTREAM_REQUESTS.count(**labels) == 2
+    assert metrics.UPSTREAM_ERRORS.value(**labels) == 1
+
+
+def test_cache_and_filter_are_measured():
+    cache = ResultCache(ttl=60, max_entries=10)
+    before = {r: metrics.CACHE_LOOKUPS.value(result=r) for r in ["hit", "miss", "joined"]}
+    before_filtered = metrics.FILTERED_RECORDS.value(op="like")
+
+    async def gen():
+        await asyncio.sleep(0.01)
+        yield {"a": "1"}
+
+    async def collect():
+        return [x async for x in cache.get("k", gen)]
+
+    async def run():
+        await asyncio.gather(collect(), collect())
+        return await collect()
+
+    records = asyncio.run(run())
+    assert filter_records(records * 3, [Label(key=".a", op="like", val="1")]) == records * 3
+    assert {r: metrics.CACHE_LOOKUPS.value(result=r) - before[r] for r in before} == {"hit": 1, "miss": 1, "joined": 1}
+    assert metrics.FILTERED_RECORDS.value(op="like") - before_filtered == 3
+
+
+def test_metrics_of_several_workers_are_summed():
+    counter = metrics.Counter("swamp_test_workers_total", "Test", ["what"])
+    histogram = metrics.Histogram("swamp_test_workers_seconds", "Test", buckets=(1.0,))
+    counter.inc(2, what="a")
+    histogram.observe(0.5)
+    other_worker = {"swamp_test_workers_total": [[["a"], 3], [["b"], 1]], "swamp_test_workers_seconds": [[[], [[0, 1], 2.0]]]}
+    lines = metrics.render([metrics.state(), other_worker]).decode().splitlines()
+    assert 'swamp_test_workers_total{what="a"} 5' in lines
+    assert 'swamp_test_workers_total{what="b"} 1' in lines
+    assert 'swamp_test_workers_seconds_bucket{le="1"} 1' in lines
+    assert 'swamp_test_workers_seconds_count 2' in lines
+    assert 'swamp_test_workers_seconds_sum 2.5' in lines
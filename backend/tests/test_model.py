@@ -1,6 +1,6 @@
 import pytest
 
-from backend.model import Label
+from backend.model import Label, _predicate, filter_records
 
 
 data = {
@@ -49,3 +49,42 @@ def test_dupa(key, op, val, result):
     label = Label(key=key, op=op, val=val)
 
     assert label.matches(data) == result
+
+
+@pytest.mark.parametrize("key,op,val,result",[
+    (".roles[]", "==", "admin", False),  # single-value ops need exactly one value
+    (".missing", "!=", "x", False),
+    (".projects[].name", "contains", "Project Y", True),
+    (".projects[].tasks[].completed", "contains", "False", False),  # falsy values are skipped
+    (".profile.address.city", "like", "Spring", True),
+    (".id", "in", '["122", "123"]', True),  # compared as join keys are, so numbers too
+    (".roles[]", "in", '["owner", "editor"]', True),
+    (".projects[].tasks[].completed", "in", '["false"]', True),
+    (".name", "in", "[]", False),
+])
+def test_label_edge_cases(key, op, val, result):
+    assert Label(key=key, op=op, val=val).matches(data) is result
+
+
+def test_in_label_needs_list_of_strings():
+    with pytest.raises(ValueError):
+        Label(key=".id", op="in", val="123")
+
+
+def test_labels_share_compiled_predicate():
+    first, second = Label(key=".id", op="==", val="123"), Label(key=".id", op="==", val="123")
+    assert first.matches(data) and second.matches(data)
+    assert _predicate(first.key, first.op, first.val) is _predicate(second.key, second.op, second.val)
+
+
+def test_filter_records_matches_label_by_label_evaluation():
+    records = [{**data, "id": i, "roles": data["roles"][: i % 4]} for i in range(200)]
+    labels = [
+        Label(key=".roles[]", op="contains", val="editor"),
+        Label(key=".id", op="like", val=r"1\d*$"),
+        Label(key=".name", op="!=", val="Bob"),
+    ]
+    expected = [r for r in records if all(l.matches(r) for l in labels)]
+    assert filter_records(records, labels) == expected
+    assert filter_records([], labels) == []
+    assert Label(key=".id", op="==", val="7").filter(records) == [records[7]]
@@ -0,0 +1,61 @@
+import asyncio
+import json
+import pytest
+
+from backend.model import GenericQueryException, GraphLink
+from backend.planner import execute, plan
+
+
+def _link(source, target, op="==", from_attr=".id", to_attr=".parent"):
+    return GraphLink(**{"from": source, "to": target, "fromAttr": from_attr, "op": op, "toAttr": to_attr})
+
+
+def test_plan_feeds_vertices_with_single_narrowing_link():
+    links = [
+        _link("vpc", "subnet"),
+        _link("subnet", "instance"),
+        _link("vpc", "sg", op="!="),  # does not narrow anything down
+        _link("a", "b"), _link("b", "a"),  # cycle
+        _link("vpc", "c"), _link("subnet", "c"),  # c is reachable by either of them
+    ]
+    feeders = plan(["vpc", "subnet", "instance", "sg", "a", "b", "c"], links)
+    assert feeders == {"subnet": 0, "instance": 1, "a": 4}
+
+
+def test_plan_rejects_unknown_vertices():
+    with pytest.raises(GenericQueryException):
+        plan(["a"], [_link("a", "b")])
+
+
+def test_execute_propagates_keys_and_runs_independent_vertices_concurrently():
+    data = {
+        "vpc": [{"id": "vpc-1"}, {"id": "vpc-2"}],
+        "subnet": [{"id": "subnet-1", "parent": "vpc-1"}, {"id": "subnet-2", "parent": "vpc-3"}],
+        "instance": [{"id": "i-1", "parent": "subnet-1"}, {"id": "i-2", "parent": "subnet-2"}],
+        "other": [{"id": "x"}],
+    }
+    queried, running, concurrent = {}, set(), {}
+
+    async def query(vertex, extra):
+        running.add(vertex)
+        await asyncio.sleep(0.01)
+        queried[vertex] = {(l.key, l.op.value): json.loads(l.val) for l in extra}
+        concurrent[vertex] = set(running)
+        running.discard(vertex)
+        return [r for r in data[vertex] if all(l.matches(r) for l in extra)]
+
+    links = [_link("vpc", "subnet"), _link("subnet", "instance")]
+    results = asyncio.run(execute(["vpc", "subnet", "instance", "other"], links, query))
+    assert queried["subnet"] == {(".parent", "in"): ["vpc-1", "vpc-2"]}
+    assert queried["instance"] == {(".parent", "in"): ["subnet-1"]}
+    assert [r["id"] for r in results["instance"]] == ["i-1"]
+    assert "other" in concurrent["vpc"]
+
+
+def test_execute_skips_vertices_with_nothing_to_link_to():
+    async def query(vertex, extra):
+        assert vertex == "vpc"
+        return []
+
+    results = asyncio.run(execute(["vpc", "subnet"], [_link("vpc", "subnet")], query))
+    assert results == {"vpc": [], "subnet": []}
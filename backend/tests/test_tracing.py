@@ -0,0 +1,47 @@
+import asyncio
+import pytest
+
+from backend import tracing
+from backend.tracing import span
+
+
+def test_spans_of_child_tasks_are_recorded_to_request_trace():
+    async def partition(name):
+        with span("partition", region=name):
+            await asyncio.sleep(0.01)
+
+    async def run():
+        with tracing.tracing(True) as trace:
+            with span("labels"):
+                pass
+            await asyncio.gather(partition("a"), partition("b"))
+        return trace
+
+    trace = asyncio.run(run())
+    spans = trace.to_dicts()
+    assert [s["name"] for s in spans] == ["labels", "partition", "partition"]
+    assert {s.get("region") for s in spans[1:]} == {"a", "b"}
+    assert all(s["duration_ms"] >= 10 for s in spans[1:])
+    timing = trace.server_timing()
+    assert timing.startswith("total;dur=")
+    assert 'partition;dur=' in timing and 'desc="region=a @' in timing
+
+
+def test_nothing_is_recorded_when_tracing_is_off():
+    with tracing.tracing(False) as trace:
+        with span("labels"):
+            pass
+    assert trace is None
+    assert not tracing.trace_requested(None)
+
+
+def test_errors_and_dropped_spans_are_marked(monkeypatch):
+    monkeypatch.setattr(tracing, "_MAX_SPANS", 1)
+    with tracing.tracing(True) as trace:
+        with pytest.raises(RuntimeError):
+            with span("upstream"):
+                raise RuntimeError("throttled")
+        with span("upstream"):
+            pass
+    assert trace.to_dicts()[0]["error"] == "error"
+    assert trace.to_dicts()[1] == {"name": "dropped", "count": 1}
@@ -1,7 +1,8 @@
+import asyncio
 import pytest
 
 from backend.model import Label, Op
-from backend.utils import get_matches
+from backend.utils import get_matches, iter_concurrently, partition_events
 
 
 @pytest.mark.parametrize("label,values,results",[
@@ -15,6 +16,71 @@ from backend.utils import get_matches
     (Label(key="x", op=Op.LIKE, val="(abc)|(def)"), ["ab", "abc", "cdef", "def"], ["abc","def"]),
     (Label(key="x", op=Op.LIKE, val="(abc)|(def)"), ["ab", "abc", "cdef"], ["abc"]),
     (Label(key="x", op=Op.NOT_LIKE, val="(abc)|(def)"), ["ab", "abc", "cdef", "def"], ["ab","cdef"]),
+    (Label(key="x", op=Op.IN, val='["b", "c"]'), ["a", "b", "c"], ["b", "c"]),
 ])
 def test_dupa(label, values, results):
     assert get_matches(label, values) == results
+
+
+def _collect(agen):
+    async def run():
+        return [x async for x in agen]
+    return asyncio.run(run())
+
+
+def _tracking_jobs(keys, running, peak):
+    def factory(key, i):
+        async def gen():
+            running[key] = running.get(key, 0) + 1
+            running[None] = running.get(None, 0) + 1
+            peak[key] = max(peak.get(key, 0), running[key])
+            peak[None] = max(peak.get(None, 0), running[None])
+            await asyncio.sleep(0.01)
+            running[key] -= 1
+            running[None] -= 1
+            yield {"key": key, "i": i}
+        return gen
+    return [({"k": key}, factory(key, i)) for i, key in enumerate(keys)]
+
+
+def test_iter_concurrently_respects_limits():
+    running, peak = {}, {}
+    jobs = _tracking_jobs(["a"] * 6 + ["b"] * 6, running, peak)
+    results = _collect(iter_concurrently(jobs, limit=3, per_key_limit=2, key="k"))
+    assert sorted(r["i"] for r in results) == list(range(12))
+    assert peak[None] == 3
+    assert peak["a"] <= 2 and peak["b"] <= 2
+
+
+def test_iter_concurrently_yields_fast_partitions_first():
+    def factory(name, delay):
+        async def gen():
+            await asyncio.sleep(delay)
+            yield name
+        return gen
+    jobs = [({}, factory("slow", 0.05)), ({}, factory("fast", 0))]
+    assert _collect(iter_concurrently(jobs, limit=2)) == ["fast", "slow"]
+
+
+def test_iter_concurrently_propagates_errors():
+    async def failing():
+        raise RuntimeError("boom")
+        yield
+    with pytest.raises(RuntimeError):
+        _collect(iter_concurrently([({}, failing)], limit=1))
+
+
+def test_iter_concurrently_reports_partition_errors_to_listener():
+    async def ok():
+        yield {"x": 1}
+
+    async def failing():
+        raise RuntimeError("boom")
+        yield
+
+    events = []
+    with partition_events(events.append):
+        results = _collect(iter_concurrently([({"p": "ok"}, ok), ({"p": "bad"}, failing)], limit=2))
+    assert results == [{"x": 1}]
+    assert {"status": "done", "partition": {"p": "ok"}, "count": 1} in events
+    assert {"status": "error", "partition": {"p": "bad"}, "count": 0, "detail": "boom"} in events
@@ -41,55 +41,65 @@ export default class Backend {
     return (suggestions[from] ?? {})[to] ?? null;
   }
 
-  async* query(vertices) {
-    const promises = vertices.filter(v => v.resourceType).map(v => {
-      return this.queryOne(v.resourceType, v.labels, v.id);
+  // refresh - results must be current, so the backend fetches them again instead of serving them from its cache
+  async* query(vertices, refresh = false) {
+    const queried = vertices.filter(v => v.resourceType);
+    const resourceTypes = Object.fromEntries(queried.map(v => [v.id, v.resourceType]));
+    const queries = queried.map(v => {
+      const [provider, resource] = v.resourceType.split(".");
+      return {
+        id: v.id,
+        provider: provider,
+        resource: resource,
+        labels: (v.labels ?? []).map(l => ({key: l.key, op: l.op ?? "==", val: l.val ?? ""}))
+      };
     });
-    yield* this.asCompleted(promises);
-  }
-
-  async queryOne(resourceType, labels, vertexId) {
-    const [provider, resource] = resourceType.split(".");
-    const qs = (labels ?? []).map(l => `${encodeURIComponent(btoa(l.key))},${encodeURIComponent(btoa(l.op ?? "=="))},${encodeURIComponent(btoa(l.val))}`).join("&");
-    return fetch(`${this.base_url}/get?_provider=${provider}&_resource=${resource}&${qs}`)
-      .then(async response => {
-        await this.throwForStatus(response);
-        return response.json();
-      }) 
-      .then(response => {
-        return response.results.map(result => {
-            return {
-              resourceType: resourceType,
-              result: result,
-              vertexId: vertexId,
-            };
-        })
-      });
-  }
-
-  async* asCompleted(promises) {
-    const pending = new Set(promises.map(async (p, i) => {
-      const items = await p;
-      return { items, index: i };
-    }));
-
-    while (pending.size > 0) {
-      const { items, index } = await Promise.race(pending);
-      
-      for (const p of pending) {
-        p.then(result => {
-          if (result.index === index) {
-            pending.delete(p);
+    const response = await fetch(`${this.base_url}/batch-get`, {
+      method: "POST",
+      headers: {"Content-Type": "application/json", ...(refresh ? {"Cache-Control": "no-cache"} : {})},
+      body: JSON.stringify({queries: queries})
+    });
+    await this.throwForStatus(response);
+    for await (const event of this.readLines(response)) {
+      switch (event.type) {
+        case "result":
+          yield {
+            resourceType: resourceTypes[event.vertex],
+            result: event.result,
+            vertexId: event.vertex,
+          };
+          break;
+        case "error":
+          throw new Error(`Query of ${resourceTypes[event.vertex]} failed: ${event.detail}.`);
+        case "partition":
+          if (event.status === "error") {
+            console.warn(`Query of ${resourceTypes[event.vertex]} failed for ${JSON.stringify(event.partition)}: ${event.detail}`);
           }
-        }).catch(() => {
-          pending.delete(p);
-        });
+          break;
+        default:
+          break;
       }
+    }
+  }
 
-      for (const item of items) {
-        yield item;
+  async* readLines(response) {
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = "";
+    while (true) {
+      const {value, done} = await reader.read();
+      if (done) {
+        break;
+      }
+      buffer += value;
+      const lines = buffer.split("\n");
+      buffer = lines.pop();
+      for (const line of lines.filter(l => l)) {
+        yield JSON.parse(line);
       }
     }
+    if (buffer) {
+      yield JSON.parse(buffer);
+    }
   }
 
   async throwForStatus(response) {
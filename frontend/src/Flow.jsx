@@ -15,6 +15,7 @@ import '@xyflow/react/dist/base.css';
 
 import { NiceButton } from './ui-elements/NiceButton';
 import Refresh from '@mui/icons-material/Refresh';
+import Sync from '@mui/icons-material/Sync';
 import Resource from './Resource';
 import Query from './Query';
 import { DagreLayoutProvider } from './layout/DagreLayoutProvider';
@@ -100,6 +101,7 @@ const SwampFlow = () => {
   const updateVertex = useQueryStore((state) => state.updateVertex);
   const links = useQueryStore((state) => state.links);
   const triggered = useQueryStore((state) => state.triggered);
+  const forceRefresh = useQueryStore((state) => state.forceRefresh);
   const setTriggered = useQueryStore((state) => state.setTriggered);
 
   useEffect(() => {
@@ -113,7 +115,7 @@ const SwampFlow = () => {
         var allNodes = [...nodes];
         var linkFromMap = linksToMap(links, (l) => l.fromVertexId);
         var linkToMap = linksToMap(links, (l) => l.toVertexId);
-        for await (const item of backend.query(vertices)) {
+        for await (const item of backend.query(vertices, forceRefresh)) {
           const id = `${item.resourceType}.${item.result._id}`
           const newNode = {
             id: id,
@@ -187,7 +189,7 @@ const SwampFlow = () => {
     }
     setTriggered(false);
     update();
-  }, [backend, triggered, setTriggered, links, nodes, setEdges, setNodes, vertices]);
+  }, [backend, triggered, forceRefresh, setTriggered, links, nodes, setEdges, setNodes, vertices]);
 
   // RF stuff
   const onConnect = useCallback(
@@ -249,6 +251,10 @@ const SwampFlow = () => {
               <Refresh sx={{mr: "5px"}}/>
               <p>Refresh graph</p>
             </NiceButton>
+            <NiceButton variant="contained"  onClick={() => setTriggered(true, true)}>
+              <Sync sx={{mr: "5px"}}/>
+              <p>Force refresh</p>
+            </NiceButton>
           </Panel>
         </ReactFlow>
     </ThemeProvider>
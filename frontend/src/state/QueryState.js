@@ -42,7 +42,8 @@ export const useQueryStore = create((set) => ({
   updateLink: (linkId, data) => set((state) => ({ links: state.links.map(l => { if (l.id !== linkId) return l; return {...l, ...data}; })})),
   setLinks: (ll) => set((state) => ({links: ll}) ),
   triggered: false, // used to actually requery backend
-  setTriggered: (val) => set((state) => ({triggered: val})),
+  forceRefresh: false, // requery bypasses backend cache
+  setTriggered: (val, forceRefresh = false) => set((state) => ({triggered: val, forceRefresh: forceRefresh})),
   redisplay: false,  // used to trigger JQ queries on display
   setRedisplay: (val) => set((state) => ({redisplay: val})),
   fields: [],